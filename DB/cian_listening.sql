@@ -11,3 +11,4 @@ CREATE TABLE
 CREATE INDEX IF NOT EXISTS idx_cian_listings_city_id ON cian_listings (city_id);
 CREATE INDEX IF NOT EXISTS idx_cian_listings_price ON cian_listings (price); 
 CREATE INDEX IF NOT EXISTS idx_cian_listings_city_price ON cian_listings (city_id, price);
+CREATE INDEX IF NOT EXISTS cian_coords_3857_gist ON cian_listings USING GIST (ST_Transform (coordinates, 3857));
@@ -0,0 +1,13 @@
+-- Конкуренты, сведённые по клеткам H3: (город, категория, разрешение, клетка).
+-- Пересчитывается в конце data_collector/organization_parse.py;
+-- бэкенд берёт отсюда вход оценки зон вместо строк организаций
+CREATE TABLE
+    IF NOT EXISTS competitor_cells (
+        city_id BIGINT REFERENCES city (id) ON DELETE CASCADE,
+        category_id BIGINT REFERENCES categories (id) ON DELETE CASCADE,
+        resolution SMALLINT NOT NULL,
+        h3_cell BIGINT NOT NULL,
+        strength_sum DOUBLE PRECISION NOT NULL,
+        org_count INT NOT NULL,
+        PRIMARY KEY (city_id, category_id, resolution, h3_cell)
+    );
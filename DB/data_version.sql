@@ -0,0 +1,9 @@
+-- Версии данных по городам: сборщики увеличивают version при каждой записи,
+-- бэкенд включает версию в ключи кэшей и так узнаёт о свежих данных
+CREATE TABLE
+    IF NOT EXISTS data_versions (
+        city_id BIGINT PRIMARY KEY REFERENCES city (id) ON DELETE CASCADE,
+        version BIGINT NOT NULL DEFAULT 1,
+        source VARCHAR(32),
+        updated_at timestamp default now ()
+    );
@@ -0,0 +1,3 @@
+-- Необязательно: расширение h3-pg для ZONES_ENGINE=postgis (оценка зон в БД)
+CREATE EXTENSION IF NOT EXISTS h3;
+CREATE EXTENSION IF NOT EXISTS h3_postgis CASCADE;
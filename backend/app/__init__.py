@@ -1,5 +1,8 @@
 from flask import Flask
 from .extensions import db
+from . import cache
+from . import concurrency
+from . import scoring_pool
 from flask_cors import CORS
 from flask_login import LoginManager
 from datetime import timedelta
@@ -16,7 +19,8 @@ def create_app():
     app = Flask(__name__)
 
     app.config.from_mapping(
-        DEBUG=True,
+        # Режим отладки только явно (run.py включает его сам)
+        DEBUG=os.environ.get("FLASK_DEBUG", "0") == "1",
         SECRET_KEY=os.environ.get("SECRET_KEY", "UNSAFE_KEY"),
         SQLALCHEMY_DATABASE_URI=os.environ.get("SQLALCHEMY_DATABASE_URI"),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
@@ -26,6 +30,36 @@ def create_app():
         SESSION_COOKIE_SECURE          = False,
         SESSION_COOKIE_HTTPONLY=True,
         SESSION_COOKIE_SAMESITE="None",
+        ZONES_ENGINE=os.environ.get("ZONES_ENGINE", "numpy"),
+        # Брать вход оценки зон из competitor_cells (см. DB/competitor_cells.sql)
+        COMPETITOR_CELLS=os.environ.get("COMPETITOR_CELLS", "1") == "1",
+        CACHE_TTL=int(os.environ.get("CACHE_TTL", 3600)),
+        CACHE_ADMIN_TOKEN=os.environ.get("CACHE_ADMIN_TOKEN"),
+        DATA_VERSION_CHECK_SECONDS=float(
+            os.environ.get("DATA_VERSION_CHECK_SECONDS", 5)
+        ),
+        SINGLE_FLIGHT_TIMEOUT=float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", 30)),
+        # Какие сжатые варианты тяжёлых ответов строить заранее
+        RESPONSE_ENCODINGS=[
+            encoding.strip()
+            for encoding in os.environ.get("RESPONSE_ENCODINGS", "br,gzip").split(",")
+            if encoding.strip()
+        ],
+        HEXES_MAX_AGE=int(os.environ.get("HEXES_MAX_AGE", 3600)),
+        TILES_MAX_AGE=int(os.environ.get("TILES_MAX_AGE", 3600)),
+        # Потоки для параллельной загрузки входных данных анализа (1 - по очереди)
+        FETCH_WORKERS=int(os.environ.get("FETCH_WORKERS", 4)),
+        # Пул процессов для оценки зон (0 - в потоке запроса), предел задач
+        # в пуле (по умолчанию 2 на процесс) и таймаут ответа в секундах
+        SCORING_PROCESSES=int(os.environ.get("SCORING_PROCESSES", 0)),
+        SCORING_QUEUE=int(os.environ.get("SCORING_QUEUE", 0)),
+        SCORING_TIMEOUT=float(os.environ.get("SCORING_TIMEOUT", 20)),
+        # Прогрев кэшей перед обслуживанием (wsgi.py): и слоёв гексагонов всех городов
+        WARM_HEXES=os.environ.get("WARM_HEXES", "0") == "1",
+        # ASGI-вход (asgi.py): пул потоков Flask и асинхронный пул соединений
+        ASGI_THREADS=int(os.environ.get("ASGI_THREADS", 8)),
+        ASYNC_DATABASE_URI=os.environ.get("ASYNC_DATABASE_URI"),
+        ASYNC_POOL_SIZE=int(os.environ.get("ASYNC_POOL_SIZE", 10)),
     )
 
     # Инициализация SQLAlchemy
@@ -36,8 +70,11 @@ def create_app():
     )
     db.init_app(app)
     login_manager.init_app(app)
+    from .routes import main_bp, load_data_versions
 
-    from .routes import main_bp
+    cache.init_app(app, load_data_versions)
+    concurrency.init_app(app)
+    scoring_pool.init_app(app)
 
     app.register_blueprint(main_bp)
 
@@ -0,0 +1,263 @@
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request, session
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from . import create_app
+from . import inputs
+from . import routes
+
+ANALYSIS_PATH = "/api/analysis"
+
+
+def async_database_uri(config):
+    """ASYNC_DATABASE_URI или SQLALCHEMY_DATABASE_URI с драйвером asyncpg"""
+    uri = config.get("ASYNC_DATABASE_URI")
+    if uri:
+        return uri
+    return make_url(config["SQLALCHEMY_DATABASE_URI"]).set(
+        drivername="postgresql+asyncpg"
+    )
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ для HTTP-запроса ASGI"""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = name
+        else:
+            key = f"HTTP_{name}"
+        # Повторные заголовки склеиваются через запятую, а cookie - через "; "
+        separator = "; " if key == "HTTP_COOKIE" else ","
+        environ[key] = f"{environ[key]}{separator}{value}" if key in environ else value
+    # Тело уже прочитано целиком: длина известна и без заголовка
+    # (например, при chunked-запросе)
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+class AsgiApp:
+    """
+    ASGI-вход бэкенда. Все маршруты (/api/*, /login, /register, /me, /logout)
+    обслуживает то же Flask-приложение в пуле потоков, поэтому сессии,
+    авторизация и ответы совпадают с WSGI-версией. Для /api/analysis входные
+    данные, которых нет в кэше, сначала читаются параллельно на цикле событий
+    через асинхронный пул соединений (asyncpg), и поток занимают только
+    оценка зон и сборка ответа.
+    """
+
+    def __init__(self, flask_app):
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        self.flask_app = flask_app
+        self.logger = flask_app.logger
+        self.executor = ThreadPoolExecutor(
+            max_workers=flask_app.config["ASGI_THREADS"], thread_name_prefix="asgi"
+        )
+        self.engine = create_async_engine(
+            async_database_uri(flask_app.config),
+            pool_size=flask_app.config["ASYNC_POOL_SIZE"],
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            if scope["path"] == ANALYSIS_PATH and scope["method"] == "GET":
+                await self.prefetch_analysis(scope)
+            await self.serve_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Как wsgi.py: готовность (/api/health/ready) - после прогрева кэшей
+                try:
+                    await self.run_in_thread(routes.warm_caches, self.flask_app)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def run_in_thread(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # --- /api/analysis: асинхронная загрузка входных данных ---
+
+    def analysis_plan(self, environ):
+        """
+        (city_id, category_id, недостающие части) для авторизованного запроса
+        с верными параметрами или None, если загружать нечего
+        """
+        with self.flask_app.request_context(environ):
+            # Пользователя из БД загрузит сам обработчик: здесь достаточно
+            # подписанной сессии с его id (нет cookie - нечего и загружать)
+            if not session.get("_user_id"):
+                return None
+            validated, errors = routes.validate_analysis_params(request.args)
+            if errors or routes.parse_analysis_options(request.args)[1]:
+                return None
+            city_id, category_id = validated["city_id"], validated["category_id"]
+            missing = routes.missing_analysis_inputs(city_id, category_id)
+            if not missing and routes.get_analysis_inputs.contains(city_id, category_id):
+                return None
+            return city_id, category_id, list(missing)
+
+    async def fetch_row(self, name, sql, params):
+        start = time.perf_counter()
+        async with self.engine.connect() as connection:
+            result = await connection.execute(text(sql), params)
+            row = result.mappings().one_or_none()
+        self.logger.info(
+            f"Async fetch {name}: {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+        return dict(row) if row else {}
+
+    def prime_inputs(self, city_id, category_id, names, row):
+        with self.flask_app.app_context():
+            parts = routes.analysis_input_parts(city_id, category_id)
+            found = routes.prime_analysis_inputs(
+                city_id, category_id, row, {name: parts[name] for name in names}
+            )
+            routes.get_analysis_inputs.prime(found, city_id, category_id)
+
+    async def prefetch_analysis(self, scope):
+        """
+        Независимые запросы (наличие города и категории, конкуренты, аренда,
+        гексагоны, граница) идут одновременно, каждый на своём соединении
+        пула; результат раскладывается по кэшам, которые затем читает
+        Flask-обработчик. При ошибке обработчик загрузит данные сам.
+        """
+        plan = await self.run_in_thread(self.analysis_plan, wsgi_environ(scope, b""))
+        if plan is None:
+            return
+        city_id, category_id, names = plan
+        params = {"city_id": city_id, "category_id": category_id}
+        queries = {"exists": inputs.EXISTS_QUERY}
+        queries.update(
+            (name, inputs.part_query(name, routes.BOUND_DETAILS)) for name in names
+        )
+        try:
+            rows = await asyncio.gather(
+                *(self.fetch_row(name, sql, params) for name, sql in queries.items())
+            )
+        except Exception as e:
+            self.logger.warning(f"Async prefetch failed: {e}")
+            return
+
+        row = {}
+        for part in rows:
+            row.update(part)
+        await self.run_in_thread(self.prime_inputs, city_id, category_id, names, row)
+
+    # --- Flask-приложение в пуле потоков ---
+
+    async def serve_wsgi(self, scope, receive, send):
+        """
+        Запрос целиком выполняется в одном потоке пула (потоковые ответы
+        держат контекст приложения в этом потоке), части тела передаются
+        на цикл событий через очередь
+        """
+        environ = wsgi_environ(scope, await read_body(receive))
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def put(*item):
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        def run():
+            def start_response(status, headers, exc_info=None):
+                put("start", status, headers)
+
+            try:
+                result = self.flask_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if chunk:
+                            put("body", chunk)
+                finally:
+                    if hasattr(result, "close"):
+                        result.close()
+            except Exception as e:
+                put("error", e)
+            finally:
+                put("end")
+
+        done = loop.run_in_executor(self.executor, run)
+        started = False
+        while True:
+            kind, *item = await queue.get()
+            if kind == "start":
+                status, headers = item
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": int(status.split(" ", 1)[0]),
+                        "headers": [
+                            (name.lower().encode("latin-1"), value.encode("latin-1"))
+                            for name, value in headers
+                        ],
+                    }
+                )
+                started = True
+            elif kind == "body":
+                await send({"type": "http.response.body", "body": item[0], "more_body": True})
+            elif kind == "error":
+                self.logger.error(f"WSGI request failed: {item[0]}")
+                if not started:
+                    await send(
+                        {
+                            "type": "http.response.start",
+                            "status": 500,
+                            "headers": [(b"content-type", b"text/plain")],
+                        }
+                    )
+                    started = True
+            else:
+                break
+        await done
+        if started:
+            await send({"type": "http.response.body", "body": b""})
+
+
+def create_asgi_app():
+    return AsgiApp(create_app())
@@ -0,0 +1,334 @@
+import functools
+import inspect
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+MB = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+# Все кэши процесса по имени: для статистики и инвалидации
+caches = {}
+
+# TTL по умолчанию для кэшей без своего ttl, задаётся через CACHE_TTL
+default_ttl = None
+
+
+def estimate_size(obj):
+    """
+    Приблизительный размер объекта в байтах с учётом вложенных контейнеров,
+    массивов NumPy и атрибутов объектов. Объекты, к которым привязаны
+    методы (например, индекс соседства за disk_of), учитываются: запись
+    держит их в памяти, даже когда их вытеснил собственный кэш.
+    """
+    total = 0
+    seen = set()
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+
+        if isinstance(item, np.ndarray):
+            total += item.nbytes
+        elif hasattr(item, "indptr") and hasattr(item, "indices"):
+            # scipy.sparse
+            total += item.data.nbytes + item.indices.nbytes + item.indptr.nbytes
+        elif isinstance(item, dict):
+            total += sys.getsizeof(item)
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            total += sys.getsizeof(item)
+            stack.extend(item)
+        elif inspect.ismethod(item):
+            total += sys.getsizeof(item)
+            stack.append(item.__self__)
+        elif inspect.isfunction(item):
+            total += sys.getsizeof(item)
+        elif hasattr(item, "__dict__"):
+            total += sys.getsizeof(item)
+            stack.append(vars(item))
+        else:
+            total += sys.getsizeof(item)
+    return total
+
+
+class SizedCache:
+    """
+    LRU-кэш, ограниченный суммарным оценочным размером значений в байтах,
+    с TTL и тегами для выборочной инвалидации (например, по городу).
+    """
+
+    def __init__(self, name, max_bytes, ttl=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Возвращает (True, значение) или (False, None)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            value, size, expires, _ = entry
+            if expires is not None and expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def contains(self, key):
+        """Есть ли живая запись, без учёта в статистике и без смены порядка LRU"""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and (entry[2] is None or entry[2] > time.monotonic())
+
+    def set(self, key, value, tags=()):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        ttl = self.ttl if self.ttl is not None else default_ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, expires, frozenset(tags))
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _, _ = self.entries.pop(key)
+        self.size -= size
+
+    def invalidate(self, tags=None):
+        """Удаляет записи, у которых есть все теги из tags (или все записи)"""
+        with self.lock:
+            if not tags:
+                removed = list(self.entries)
+            else:
+                tags = set(tags)
+                removed = [
+                    key
+                    for key, (_, _, _, entry_tags) in self.entries.items()
+                    if tags <= entry_tags
+                ]
+            for key in removed:
+                self._remove(key)
+            self.invalidations += len(removed)
+            return len(removed)
+
+    def clear(self):
+        return self.invalidate()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl if self.ttl is not None else default_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class DataVersions:
+    """
+    Версии данных городов (таблица data_versions). Перечитываются не чаще
+    раза в interval секунд; при смене версии записи города сбрасываются.
+    """
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.loader = None
+        self.versions = {}
+        self.checked = float("-inf")
+        self.lock = threading.Lock()
+
+    def get(self, city_id):
+        self.refresh()
+        return self.versions.get(city_id, 0)
+
+    def refresh(self):
+        if self.loader is None or time.monotonic() - self.checked < self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked < self.interval:
+                return
+            self.checked = now
+            try:
+                versions = self.loader()
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать версии данных: {e}")
+                return
+            if versions is None:  # вне контекста приложения
+                return
+            changed = {
+                city_id
+                for city_id in set(versions) | set(self.versions)
+                if versions.get(city_id, 0) != self.versions.get(city_id, 0)
+            }
+            self.versions = versions
+
+        for city_id in changed:
+            logger.info(f"Данные города {city_id} обновились, сброс кэшей")
+            invalidate(city_id=city_id)
+
+
+data_versions = DataVersions()
+
+
+class SingleFlight:
+    """
+    Схлопывание одновременных промахов: по каждому ключу считает только
+    первый поток, остальные ждут его результата не дольше timeout секунд.
+    """
+
+    def __init__(self, timeout=30.0):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event()}
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call["done"].wait(self.timeout):
+                raise TimeoutError(f"Не дождались вычисления {key!r}")
+            if "error" in call:
+                raise call["error"]
+            return call["value"]
+
+        try:
+            call["value"] = func()
+            return call["value"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+
+flights = SingleFlight()
+
+
+def cached(name, max_bytes, ttl=None, tags=()):
+    """
+    Декоратор вместо lru_cache. tags - имена аргументов (например,
+    "city_id", "category_id"), по которым записи можно инвалидировать.
+    Если среди tags есть city_id, в ключ входит версия данных города.
+    Одновременные промахи по одному ключу считаются один раз (SingleFlight).
+    wrapper.prime(value, *args) кладёт готовое значение под ключ аргументов
+    (когда оно получено другим путём, например общим запросом),
+    wrapper.contains(*args) проверяет, есть ли запись.
+    """
+
+    def decorator(func):
+        cache = SizedCache(name, max_bytes, ttl)
+        caches[name] = cache
+        signature = inspect.signature(func)
+
+        def make_key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(bound.arguments.values())
+            if "city_id" in tags:
+                key += (data_versions.get(bound.arguments["city_id"]),)
+            return key, {(tag, bound.arguments[tag]) for tag in tags}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key, entry_tags = make_key(args, kwargs)
+            found, value = cache.get(key)
+            if found:
+                return value
+
+            def compute():
+                value = func(*args, **kwargs)
+                cache.set(key, value, entry_tags)
+                return value
+
+            return flights.do((name, key), compute)
+
+        def prime(value, *args, **kwargs):
+            key, entry_tags = make_key(args, kwargs)
+            cache.set(key, value, entry_tags)
+
+        def contains(*args, **kwargs):
+            return cache.contains(make_key(args, kwargs)[0])
+
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        wrapper.prime = prime
+        wrapper.contains = contains
+        return wrapper
+
+    return decorator
+
+
+def invalidate(city_id=None, category_id=None):
+    """
+    Инвалидация по городу и/или категории во всех кэшах. В кэшах без таких
+    тегов ничего не удаляется; без параметров очищается всё.
+    Возвращает число удалённых записей по кэшам.
+    """
+    tags = set()
+    if city_id is not None:
+        tags.add(("city_id", city_id))
+    if category_id is not None:
+        tags.add(("category_id", category_id))
+
+    return {name: cache.invalidate(tags) for name, cache in caches.items()}
+
+
+def stats():
+    result = {name: cache.stats() for name, cache in caches.items()}
+    result["single_flight"] = {
+        "in_flight": len(flights.calls),
+        "coalesced": flights.coalesced,
+        "timeout": flights.timeout,
+    }
+    return result
+
+
+def init_app(app, version_loader=None):
+    global default_ttl
+    default_ttl = app.config.get("CACHE_TTL") or None
+    data_versions.interval = app.config.get("DATA_VERSION_CHECK_SECONDS", 5)
+    data_versions.loader = version_loader
+    flights.timeout = app.config.get("SINGLE_FLIGHT_TIMEOUT", 30)
@@ -0,0 +1,92 @@
+import h3.api.numpy_int as h3int
+import numpy as np
+
+# Полосы масштаба карты: (наибольший zoom полосы, разрешение H3 кластеров).
+# При zoom больше последней полосы точки отдаются без кластеризации.
+ZOOM_BANDS = (
+    (9, 6),
+    (11, 7),
+    (13, 8),
+    (15, 9),
+)
+
+
+def cluster_resolution(zoom):
+    """Разрешение H3 для масштаба zoom или None, если кластеризовать не нужно"""
+    for max_zoom, resolution in ZOOM_BANDS:
+        if zoom <= max_zoom:
+            return resolution
+    return None
+
+
+class PointClusters:
+    """
+    Точки (объявления, организации), разложенные по клеткам H3 одного
+    разрешения. Кластеры считаются по любому префиксу точек, поэтому для
+    объявлений, отсортированных по цене, лимит аренды - это просто длина
+    префикса, без повторного обхода точек.
+    """
+
+    def __init__(self, lats, lons, values, resolution):
+        self.resolution = resolution
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        cells = np.fromiter(
+            (
+                h3int.latlng_to_cell(lat, lon, resolution)
+                for lat, lon in zip(self.lats, self.lons)
+            ),
+            dtype=np.uint64,
+            count=len(self.lats),
+        )
+        self.cells, self.slots = np.unique(cells, return_inverse=True)
+
+    @classmethod
+    def from_points(cls, points, value_key, resolution):
+        """Точки {"coordinates": [lat, lon], value_key: ...} в исходном порядке"""
+        return cls(
+            [point["coordinates"][0] for point in points],
+            [point["coordinates"][1] for point in points],
+            [point.get(value_key) or 0 for point in points],
+            resolution,
+        )
+
+    def sums(self, m=None):
+        """
+        По непустым кластерам первых m точек: (число точек, центр масс -
+        широты и долготы, сумма значений)
+        """
+        slots = self.slots[:m]
+        size = len(self.cells)
+        count = np.bincount(slots, minlength=size)
+        nonempty = np.flatnonzero(count)
+        count = count[nonempty]
+        lat = np.bincount(slots, weights=self.lats[:m], minlength=size)[nonempty]
+        lon = np.bincount(slots, weights=self.lons[:m], minlength=size)[nonempty]
+        total = np.bincount(slots, weights=self.values[:m], minlength=size)[nonempty]
+        return count, lat / count, lon / count, total
+
+    def rental_clusters(self, m=None):
+        """Кластеры объявлений: число и средняя цена"""
+        count, lat, lon, total = self.sums(m)
+        return [
+            {
+                "coordinates": [float(lat[i]), float(lon[i])],
+                "count": int(count[i]),
+                "avg_price": int(total[i] / count[i]),
+            }
+            for i in range(len(count))
+        ]
+
+    def competitor_clusters(self, m=None):
+        """Кластеры конкурентов: число и суммарная сила"""
+        count, lat, lon, total = self.sums(m)
+        return [
+            {
+                "coordinates": [float(lat[i]), float(lon[i])],
+                "count": int(count[i]),
+                "strength": float(total[i]),
+            }
+            for i in range(len(count))
+        ]
@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+# Общий пул потоков для независимых запросов к БД; размер - FETCH_WORKERS
+executor = None
+
+
+def run_concurrently(tasks):
+    """
+    Выполняет независимые загрузки {имя: (функция, аргументы)} параллельно
+    в пуле потоков. Каждая идёт в своём контексте приложения, а значит со
+    своей сессией SQLAlchemy и своим соединением из пула. Возвращает
+    {имя: результат}; исключение загрузки пробрасывается вызывающему.
+    Время каждой загрузки пишется в лог.
+    """
+    app = current_app._get_current_object()
+
+    def run(name, func, args):
+        start = time.perf_counter()
+        with app.app_context():
+            result = func(*args)
+        app.logger.info(f"Fetch {name}: {(time.perf_counter() - start) * 1000:.1f} ms")
+        return result
+
+    if executor is None or len(tasks) < 2:
+        return {name: run(name, func, args) for name, (func, args) in tasks.items()}
+
+    futures = {
+        name: executor.submit(run, name, func, args)
+        for name, (func, args) in tasks.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+
+def init_app(app):
+    global executor
+    workers = app.config.get("FETCH_WORKERS", 4)
+    if executor is not None:
+        executor.shutdown(wait=False)
+    executor = (
+        ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch")
+        if workers > 1
+        else None
+    )
+
+
+def after_fork(app):
+    """В дочернем процессе: потоков пула родителя здесь нет, создаём свой пул"""
+    global executor
+    executor = None
+    init_app(app)
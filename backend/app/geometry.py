@@ -0,0 +1,23 @@
+import numpy as np
+import shapely
+
+
+def decode_points(wkbs):
+    """WKB точек (bytes или memoryview) -> массивы широт и долгот одним вызовом shapely"""
+    geometries = shapely.from_wkb(np.array([bytes(wkb) for wkb in wkbs], dtype=object))
+    coordinates = shapely.get_coordinates(geometries)
+    return coordinates[:, 1], coordinates[:, 0]
+
+
+def with_coordinates(rows):
+    """
+    Строки (wkb, ...) -> кортежи (lat, lon, ...). Точки декодируются пачкой,
+    а не ST_Y/ST_X в БД и преобразованием каждой строки по отдельности.
+    """
+    if not rows:
+        return []
+    lats, lons = decode_points([row[0] for row in rows])
+    return [
+        (lat, lon, *row[1:])
+        for lat, lon, row in zip(lats.tolist(), lons.tolist(), rows)
+    ]
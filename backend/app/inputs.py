@@ -0,0 +1,92 @@
+from sqlalchemy import text
+
+from .extensions import db
+
+# Части входных данных анализа: CTE с одной строкой агрегатов. Запрашиваются
+# только те части, которых нет в кэше, но всегда одним запросом к БД.
+PART_QUERIES = {
+    "competitors": """
+        SELECT
+            array_agg(ST_Y(o.coordinates) ORDER BY o.id) AS comp_lat,
+            array_agg(ST_X(o.coordinates) ORDER BY o.id) AS comp_lon,
+            array_agg(o.name ORDER BY o.id) AS comp_name,
+            array_agg(o.rate ORDER BY o.id) AS comp_rate,
+            array_agg(o.rate_count ORDER BY o.id) AS comp_rate_count,
+            array_agg(o.strength ORDER BY o.id) AS comp_strength
+        FROM organizations o
+        JOIN organization_categories oc ON oc.organization_id = o.id
+        WHERE o.city_id = :city_id
+          AND oc.category_id = :category_id
+          AND o.coordinates IS NOT NULL
+    """,
+    "rentals": """
+        SELECT
+            array_agg(ST_Y(c.coordinates)) AS rent_lat,
+            array_agg(ST_X(c.coordinates)) AS rent_lon,
+            array_agg(c.cian_id) AS rent_id,
+            array_agg(c.price) AS rent_price,
+            array_agg(c.total_area) AS rent_total_area
+        FROM cian_listings c
+        WHERE c.city_id = :city_id AND c.price IS NOT NULL
+    """,
+    "hexes": """
+        SELECT
+            array_agg(h.id ORDER BY h.id) AS hex_ids,
+            array_agg(h.population ORDER BY h.id) AS hex_pops
+        FROM city_hexagons h
+        WHERE h.city_id = :city_id
+    """,
+}
+
+
+def bounds_query(details):
+    """CTE границы города на уровнях details {имя: (допуск, знаков)}"""
+    columns = []
+    for name, (tolerance, precision) in details.items():
+        geometry = "b.geom"
+        if tolerance:
+            geometry = f"ST_SimplifyPreserveTopology(b.geom, {float(tolerance)})"
+        columns.append(f"ST_AsGeoJSON({geometry}, {int(precision)}) AS bound_{name}")
+    return f"""
+        SELECT {", ".join(columns)}
+        FROM city_boundaries b
+        WHERE b.city_id = :city_id
+        LIMIT 1
+    """
+
+
+EXISTS_QUERY = """
+    SELECT
+        EXISTS (SELECT 1 FROM city WHERE id = :city_id) AS city_found,
+        EXISTS (SELECT 1 FROM categories WHERE id = :category_id) AS category_found
+"""
+
+
+def part_query(name, bound_details=None):
+    """Запрос одной части (для отдельного выполнения, например асинхронно)"""
+    if name == "bounds":
+        return bounds_query(bound_details)
+    return PART_QUERIES[name]
+
+
+def fetch_inputs(city_id, category_id, parts, bound_details=None):
+    """
+    Один запрос: есть ли город и категория, плюс части parts
+    (competitors, rentals, hexes, bounds - нужен bound_details).
+    Возвращает словарь столбцов; пустые агрегаты - None.
+    """
+    ctes = {name: part_query(name, bound_details) for name in parts}
+
+    sql = ""
+    if ctes:
+        sql = "WITH " + ",\n".join(f"{name} AS ({query})" for name, query in ctes.items())
+    sql += EXISTS_QUERY
+    if ctes:
+        sql += ", " + ", ".join(f"{name}.*" for name in ctes)
+    # У границы может не быть строки, агрегаты возвращают строку всегда
+    sql += " FROM (SELECT 1) AS one"
+    for name in ctes:
+        sql += f" LEFT JOIN {name} ON true"
+
+    params = {"city_id": city_id, "category_id": category_id}
+    return dict(db.session.execute(text(sql), params).mappings().one())
@@ -7,3 +7,5 @@ from .hex import Hexagon
 from .bound import CityBound
 from .user import User
 from .requests import AnalysisRequest
+from .data_version import DataVersion
+from .competitor_cell import CompetitorCell
@@ -0,0 +1,14 @@
+from app import db
+
+
+class CompetitorCell(db.Model):
+    __tablename__ = "competitor_cells"
+
+    city_id = db.Column(db.BigInteger, db.ForeignKey("city.id"), primary_key=True)
+    category_id = db.Column(
+        db.BigInteger, db.ForeignKey("categories.id"), primary_key=True
+    )
+    resolution = db.Column(db.SmallInteger, primary_key=True)
+    h3_cell = db.Column(db.BigInteger, primary_key=True)
+    strength_sum = db.Column(db.Double, nullable=False)
+    org_count = db.Column(db.Integer, nullable=False)
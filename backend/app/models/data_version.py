@@ -0,0 +1,11 @@
+from app import db
+from sqlalchemy import func
+
+
+class DataVersion(db.Model):
+    __tablename__ = "data_versions"
+
+    city_id = db.Column(db.BigInteger, db.ForeignKey("city.id"), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=1)
+    source = db.Column(db.String(32))
+    updated_at = db.Column(db.DateTime, server_default=func.now())
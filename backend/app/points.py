@@ -0,0 +1,106 @@
+from sqlalchemy import text
+
+from .extensions import db
+from .geometry import with_coordinates
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+# Сколько строк за раз забирать из серверного курсора при потоковой отдаче
+FETCH_ROWS = 500
+
+# Постраничная выборка по ключу (id > :after ORDER BY id). Фильтр {bbox}
+# подставляется только при заданном окне карты: охват в 3857, как в tiles.py,
+# чтобы использовались GiST-индексы по выражению
+POINT_QUERIES = {
+    "competitors": """
+        SELECT
+            ST_AsBinary(o.coordinates) AS wkb,
+            o.id,
+            o.name,
+            o.rate,
+            o.rate_count,
+            o.strength,
+            o.address
+        FROM organizations o
+        JOIN organization_categories oc ON oc.organization_id = o.id
+        WHERE o.city_id = :city_id
+          AND oc.category_id = :category_id
+          AND o.id > :after
+          AND o.coordinates IS NOT NULL
+          {bbox}
+        ORDER BY o.id
+        LIMIT :limit
+    """,
+    "rentals": """
+        SELECT
+            ST_AsBinary(c.coordinates) AS wkb,
+            c.cian_id AS id,
+            c.price,
+            c.total_area
+        FROM cian_listings c
+        WHERE c.city_id = :city_id
+          AND (CAST(:rent AS integer) IS NULL OR c.price <= :rent)
+          AND c.cian_id > :after
+          {bbox}
+        ORDER BY c.cian_id
+        LIMIT :limit
+    """,
+}
+
+BBOX_FILTERS = {
+    "competitors": "AND ST_Transform(o.coordinates, 3857) && {envelope}",
+    "rentals": "AND ST_Transform(c.coordinates, 3857) && {envelope}",
+}
+
+ENVELOPE = "ST_Transform(ST_MakeEnvelope(:west, :south, :east, :north, 4326), 3857)"
+# Широты за пределами Web Mercator в 3857 не проецируются: окно обрезается
+MAX_LATITUDE = 85.0511
+
+# Поля строки, кроме id и координат
+POINT_FIELDS = {
+    "competitors": ("name", "rate", "rate_count", "strength", "address"),
+    "rentals": ("price", "total_area"),
+}
+
+
+def parse_bbox(value):
+    """
+    "west,south,east,north" в градусах -> кортеж из 4 чисел, широты обрезаны
+    до MAX_LATITUDE. ValueError, если окно задано неверно.
+    """
+    parts = [float(part) for part in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox: нужно 4 числа")
+    west, south, east, north = parts
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValueError("bbox: неверные границы")
+    south = max(south, -MAX_LATITUDE)
+    north = min(north, MAX_LATITUDE)
+    if south >= north:
+        raise ValueError("bbox: окно вне широт Web Mercator")
+    return west, south, east, north
+
+
+def iter_points(layer, city_id, bbox=None, after=0, limit=DEFAULT_LIMIT, **filters):
+    """
+    Точки слоя (competitors - нужен category_id, rentals - необязательный rent)
+    с id больше after, не более limit штук, по возрастанию id. Строки читаются
+    из серверного курсора порциями, точки порции декодируются из WKB разом.
+    """
+    envelope = BBOX_FILTERS[layer].format(envelope=ENVELOPE) if bbox else ""
+    query = text(POINT_QUERIES[layer].format(bbox=envelope))
+    params = {"city_id": city_id, "after": after, "limit": limit, "rent": None}
+    params.update(filters)
+    if bbox:
+        params.update(zip(("west", "south", "east", "north"), bbox))
+
+    rows = db.session.execute(
+        query.execution_options(stream_results=True, yield_per=FETCH_ROWS), params
+    )
+    fields = POINT_FIELDS[layer]
+    for batch in rows.partitions():
+        for lat, lon, point_id, *values in with_coordinates(batch):
+            point = {"id": point_id, "coordinates": [lat, lon]}
+            point.update(zip(fields, values))
+            yield point
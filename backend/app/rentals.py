@@ -0,0 +1,47 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+
+class RentalIndex:
+    """
+    Объявления аренды одного города, отсортированные по цене.
+    Выборка под лимит аренды - бинарный поиск, средние - префиксные суммы,
+    поэтому смена лимита не требует запроса к БД.
+    """
+
+    def __init__(self, places):
+        self.places = sorted(places, key=lambda place: place["price"])
+        self.prices = [place["price"] for place in self.places]
+        self.price_sums = [0, *accumulate(self.prices)]
+
+        per_square = [
+            (place["price"] / place["total_area"], 1)
+            if place.get("total_area")
+            else (0.0, 0)
+            for place in self.places
+        ]
+        self.per_square_sums = [0.0, *accumulate(value for value, _ in per_square)]
+        self.per_square_counts = [0, *accumulate(valid for _, valid in per_square)]
+
+    def count(self, rent_limit):
+        return bisect_right(self.prices, rent_limit)
+
+    def places_up_to(self, rent_limit):
+        return self.places[: self.count(rent_limit)]
+
+    def avg_rent(self, rent_limit):
+        """Как calculate_avg_rent; None, если подходящих объявлений нет"""
+        m = self.count(rent_limit)
+        if not m:
+            return None
+        return int(self.price_sums[m] / m)
+
+    def avg_cost_for_square(self, rent_limit):
+        """Как calculate_avg_cost_for_square; None, если подходящих объявлений нет"""
+        m = self.count(rent_limit)
+        if not m:
+            return None
+        valid = self.per_square_counts[m]
+        if not valid:
+            return 0
+        return int(self.per_square_sums[m] / valid)
@@ -0,0 +1,73 @@
+import gzip
+
+from flask import Response, current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаём gzip
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def compact_json(obj):
+    """JSON провайдера приложения без пробелов после разделителей, как у jsonify"""
+    return current_app.json.dumps(obj, separators=(",", ":"))
+
+
+class EncodedBody:
+    """
+    Готовое тело ответа (JSON, MVT): исходные байты и сжатые варианты, построенные
+    один раз. При попадании в кэш ответ отдаётся без кодирования и сжатия.
+    """
+
+    def __init__(self, raw, encodings=("br", "gzip"), mimetype="application/json"):
+        self.raw = raw
+        self.mimetype = mimetype
+        self.variants = {}
+        if "br" in encodings and brotli is not None:
+            self.variants["br"] = brotli.compress(raw, quality=BROTLI_QUALITY)
+        if "gzip" in encodings:
+            self.variants["gzip"] = gzip.compress(raw, compresslevel=GZIP_LEVEL)
+
+    @classmethod
+    def from_text(cls, text, encodings=("br", "gzip")):
+        return cls(text.encode("utf-8"), encodings)
+
+    @classmethod
+    def from_json(cls, obj, encodings=("br", "gzip")):
+        """Тело с теми же байтами, что дал бы jsonify(obj)"""
+        return cls.from_text(compact_json(obj) + "\n", encodings)
+
+    def choose(self, accept_encodings):
+        """(кодировка или None, байты) по заголовку Accept-Encoding"""
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding, self.variants[encoding]
+        return None, self.raw
+
+    def response(self, status=200, etag=None, cache_control=None):
+        """
+        Ответ с выбранным по Accept-Encoding вариантом. etag - основа сильного
+        ETag (к ней добавляется кодировка, т.к. байты вариантов различаются);
+        при совпадении с If-None-Match отдаётся 304 без тела.
+        """
+        encoding, data = self.choose(request.accept_encodings)
+        headers = {"Vary": "Accept-Encoding"}
+        if cache_control:
+            headers["Cache-Control"] = cache_control
+
+        if etag is not None:
+            etag = f"{etag}-{encoding or 'identity'}"
+            if request.if_none_match.contains(etag):
+                response = Response(status=304, headers=headers)
+                response.set_etag(etag)
+                return response
+
+        response = Response(data, status=status, mimetype=self.mimetype, headers=headers)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if etag is not None:
+            response.set_etag(etag)
+        return response
@@ -1,18 +1,37 @@
-from flask import Blueprint, jsonify, request, session, current_app
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    request,
+    session,
+    current_app,
+    has_app_context,
+    stream_with_context,
+)
 from app.models import (
-    City,
-    Category,
     User,
     AnalysisRequest,
+    DataVersion,
 )
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from . import login_manager
 from .extensions import db
+from .rentals import RentalIndex
+from .responses import EncodedBody, compact_json
+from .clusters import PointClusters, cluster_resolution
+from .geometry import with_coordinates
+from . import tiles
+from . import points
+from . import inputs
+from . import concurrency
+from . import scoring_pool
 import math
 import h3
 import datetime
-from functools import lru_cache
+from .cache import cached, MB
+from . import cache
+import hmac
 
 main_bp = Blueprint("main", __name__)
 
@@ -24,6 +43,17 @@ MIN_COMPETITORS = 1
 MAX_COMPETITORS = 20
 MIN_AREA_COUNT = 1
 MAX_AREA_COUNT = 100
+ZONES_RESOLUTION = 10
+HEXES_LAYER_VERSION = 2  # меняется вместе с форматом слоя гексагонов (входит в ETag)
+# geojson - FeatureCollection с полигонами, compact - параллельные массивы id/населения
+HEX_FORMATS = ("geojson", "compact")
+# Уровни детализации границы города: (допуск упрощения в градусах, знаков после запятой)
+BOUND_DETAILS = {
+    "full": (None, 6),
+    "medium": (0.0002, 5),
+    "light": (0.001, 5),
+}
+DEFAULT_ANALYSIS_BOUND_DETAIL = "light"
 
 
 # --- Функция для валидации параметров ---
@@ -193,7 +223,9 @@ def get_analysis_history():
         return jsonify({"message": "Не удалось получить историю запросов."}), 500
 
 
-@lru_cache()
+# Списки городов и категорий без TTL: прогреваются до форка воркеров
+# (wsgi.py) и делятся ими copy-on-write
+@cached("cities", max_bytes=4 * MB, ttl=0)
 def get_cities_cached():
     from app.models import City
     from shapely.wkb import loads as load_wkb
@@ -219,7 +251,8 @@ def get_cities_cached():
     return result
 
 
-@lru_cache()
+# Без TTL, как и список городов
+@cached("categories", max_bytes=1 * MB, ttl=0)
 def get_categories_cached():
     from app.models import Category
     from flask import current_app
@@ -242,6 +275,33 @@ def get_categories_cached():
     return result[1:]
 
 
+def warm_caches(app):
+    """
+    Прогрев кэшей городов и категорий (и, при WARM_HEXES, слоёв гексагонов).
+    Вызывается при запуске (wsgi.py - до форка воркеров, чтобы они делили эту
+    память copy-on-write; lifespan ASGI; run.py), после неё сервис готов.
+    """
+    with app.app_context():
+        cities = get_cities_cached()
+        get_categories_cached()
+        if app.config.get("WARM_HEXES"):
+            for city in cities:
+                get_hex_layer(city["id"])
+    app.extensions["caches_warm"] = True
+    app.logger.info(f"Кэши прогреты: {len(cities)} городов")
+
+
+@main_bp.route("/api/health/ready", methods=["GET"])
+def readiness():
+    """
+    Готовность к трафику: кэши прогреты при запуске. Сброс кэшей позже
+    готовность не снимает - записи снова заполнятся первыми запросами.
+    """
+    if current_app.extensions.get("caches_warm"):
+        return jsonify({"status": "ready"})
+    return jsonify({"status": "warming"}), 503
+
+
 @main_bp.route("/api/cities", methods=["GET"])
 def get_cities():
     result = get_cities_cached()
@@ -256,41 +316,386 @@ def get_categories():
     return jsonify(result)
 
 
-@lru_cache(maxsize=512)
+def load_data_versions():
+    """Текущие версии данных по городам; вызывается слоем кэша раз в несколько секунд"""
+    if not has_app_context():
+        return None
+    try:
+        return dict(db.session.query(DataVersion.city_id, DataVersion.version).all())
+    except Exception:
+        db.session.rollback()  # чтобы не оставить сессию в сломанной транзакции
+        raise
+
+
+def is_cache_admin():
+    token = current_app.config.get("CACHE_ADMIN_TOKEN")
+    given = request.headers.get("X-Admin-Token", "")
+    return bool(token) and hmac.compare_digest(given, token)
+
+
+@main_bp.route("/api/admin/cache", methods=["GET"])
+def get_cache_stats():
+    if not is_cache_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify(cache.stats())
+
+
+@main_bp.route("/api/admin/cache", methods=["DELETE"])
+def invalidate_cache():
+    """Сброс кэшей: по city_id и/или category_id, без параметров - всех"""
+    if not is_cache_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        city_id = request.args.get("city_id")
+        city_id = int(city_id) if city_id is not None else None
+        category_id = request.args.get("category_id")
+        category_id = int(category_id) if category_id is not None else None
+    except ValueError:
+        return jsonify({"error": "city_id и category_id должны быть целыми"}), 400
+    removed = cache.invalidate(city_id=city_id, category_id=category_id)
+    current_app.logger.info(
+        f"Cache invalidated: city_id={city_id}, category_id={category_id}, {removed}"
+    )
+    return jsonify({"removed": removed})
+
+
+@cached("scored_zones", max_bytes=256 * MB, tags=("city_id", "category_id"))
+def get_scored_zones(city_id, category_id, k):
+    """Слой 1: оценки кандидатов, зависят только от города, категории и k"""
+    if current_app.config.get("ZONES_ENGINE") == "postgis":
+        # Оценка в БД (h3-pg): входные массивы в Python не нужны
+        return PostgisZones(city_id, category_id, ZONES_RESOLUTION, k)
+    scorer = ZONE_SCORERS.get(current_app.config.get("ZONES_ENGINE"), score_zones_python)
+    org_cells, org_strength, org_count = get_competitor_cells(
+        city_id, category_id, ZONES_RESOLUTION
+    )
+    return scorer(
+        *get_hex_cells(city_id),
+        org_cells,
+        org_strength,
+        ZONES_RESOLUTION,
+        k,
+        cache_key=city_id,
+        org_count=org_count,
+    )
+
+
+@cached("top_zones", max_bytes=32 * MB, tags=("city_id", "category_id"))
+def get_top_zones(city_id, category_id, k, max_competitors_count):
+    """
+    Слой 2: жадный выбор поверх оценок. Выбор на n зон - префикс выбора
+    на MAX_AREA_COUNT, поэтому n в ключ не входит.
+    """
+    engine = current_app.config.get("ZONES_ENGINE")
+    if scoring_pool.enabled(engine):
+        # Оценка держит GIL: в пуле процессов она не тормозит лёгкие запросы
+        try:
+            return scoring_pool.top_zones(
+                (city_id, category_id, k, cache.data_versions.get(city_id)),
+                get_hex_cells(city_id),
+                get_competitor_cells(city_id, category_id, ZONES_RESOLUTION),
+                engine,
+                ZONES_RESOLUTION,
+                k,
+                max_competitors_count,
+                MAX_AREA_COUNT,
+            )
+        except scoring_pool.BrokenProcessPool:
+            current_app.logger.warning("Пул оценки зон пересоздан, оценка в потоке запроса")
+    scored = get_scored_zones(city_id, category_id, k)
+    return scored.select(max_competitors_count, MAX_AREA_COUNT)
+
+
+def get_rent_summary(city_id, rent_limit):
+    """Слой аренды: не зависит от категории и параметров зон"""
+    index = get_rental_index(city_id)
+    return (
+        index.places_up_to(rent_limit),
+        index.avg_rent(rent_limit),
+        index.avg_cost_for_square(rent_limit),
+    )
+
+
+def analysis_input_parts(city_id, category_id):
+    """Независимые входные данные анализа: {имя: (загрузчик, аргументы)}"""
+    return {
+        "competitors": (get_competitors, (city_id, category_id)),
+        "rentals": (get_rental_index, (city_id,)),
+        "hexes": (get_hex_layer, (city_id,)),
+        "bounds": (get_bounds, (city_id,)),
+    }
+
+
+def missing_analysis_inputs(city_id, category_id):
+    """Части входных данных, которых нет в кэшах загрузчиков"""
+    return {
+        name: (loader, args)
+        for name, (loader, args) in analysis_input_parts(city_id, category_id).items()
+        if not loader.contains(*args)
+    }
+
+
+def prefetch_analysis_inputs(city_id, category_id):
+    """
+    Загружает в кэши недостающие входные данные анализа параллельно:
+    время холодного анализа - максимум загрузок, а не их сумма
+    """
+    concurrency.run_concurrently(missing_analysis_inputs(city_id, category_id))
+
+
 def compute_analysis(
-    city_id, category_id, radius_km, rent_limit, max_competitors_count, n_areas
+    city_id,
+    category_id,
+    radius_km,
+    rent_limit,
+    max_competitors_count,
+    n_areas,
+    hex_format="geojson",
+    bound_detail=DEFAULT_ANALYSIS_BOUND_DETAIL,
+    clusters=None,
 ):
-    rent_places = get_rental_places(city_id, rent_limit)
+    """clusters - разрешение H3 для кластеров аренды и конкурентов (None - точки)"""
+    prefetch_analysis_inputs(city_id, category_id)
+    k = grid_k(ZONES_RESOLUTION, radius_km * 1000)
+    zones = get_top_zones(city_id, category_id, k, max_competitors_count)
+    # Копии: закэшированные словари зон не меняем
+    locations = [dict(zone, id=i) for i, zone in enumerate(zones[:n_areas])]
+    rent_places, avg_rent, avg_for_square = get_rent_summary(city_id, rent_limit)
     competitors = get_competitors(city_id, category_id)
-    hexs_geojson = get_hexs(city_id)
-    radius_m = radius_km * 1000
-
-    locations = find_top_zones(
-        [geo["properties"] for geo in hexs_geojson["features"]],
-        competitors,
-        10,
-        radius_m,
-        max_competitors_count,
-        n_areas,
-    )
-
-    for i, location in enumerate(locations):
-        location["id"] = i
+    if clusters is not None:
+        rent_places = get_rental_clusters(city_id, rent_limit, clusters)
+        competitors = get_competitor_clusters(city_id, category_id, clusters)
 
     return {
         "locations": locations,  # Список найденных локаций
         "circle_radius_km": radius_km,
         "rent_places": rent_places,
-        "avg_rent": calculate_avg_rent(rent_places) if rent_places else None,
-        "avg_for_square": (
-            calculate_avg_cost_for_square(rent_places) if rent_places else None
-        ),
+        "avg_rent": avg_rent,
+        "avg_for_square": avg_for_square,
         "competitors": competitors,
-        "bounds": get_bound(city_id),
-        "hexs": hexs_geojson,
+        "cluster_resolution": clusters,
+        "bounds": get_bound(city_id, bound_detail),
+        # Без гексагонов клиент берёт слой из /api/cities/<id>/hexes (кэшируемый)
+        "hexs": get_hex_payload(city_id, hex_format) if hex_format else None,
     }
 
 
+@cached("analysis_body", max_bytes=512 * MB, tags=("city_id", "category_id"))
+def get_analysis_body(
+    city_id,
+    category_id,
+    radius_km,
+    rent_limit,
+    max_competitors_count,
+    n_areas,
+    hex_format="geojson",
+    bound_detail=DEFAULT_ANALYSIS_BOUND_DETAIL,
+    clusters=None,
+):
+    """Готовое (закодированное и сжатое) тело ответа /api/analysis"""
+    result = compute_analysis(
+        city_id,
+        category_id,
+        radius_km,
+        rent_limit,
+        max_competitors_count,
+        n_areas,
+        hex_format,
+        bound_detail,
+        clusters,
+    )
+    return EncodedBody.from_json(result, current_app.config["RESPONSE_ENCODINGS"])
+
+
+def get_hex_payload(city_id, hex_format):
+    if hex_format == "compact":
+        return get_hex_layer(city_id)
+    return get_hexs(city_id)
+
+
+def parse_hex_format(args, name):
+    """Формат слоя гексагонов из запроса или None, если формат неизвестен"""
+    hex_format = args.get(name, "geojson").lower()
+    return hex_format if hex_format in HEX_FORMATS else None
+
+
+@cached("hexes_body", max_bytes=512 * MB, tags=("city_id",))
+def get_hexes_body(city_id, hex_format):
+    return EncodedBody.from_json(
+        get_hex_payload(city_id, hex_format), current_app.config["RESPONSE_ENCODINGS"]
+    )
+
+
+@main_bp.route("/api/cities/<int:city_id>/hexes", methods=["GET"])
+def get_city_hexes(city_id):
+    """
+    Слой гексагонов города отдельно от анализа: зависит только от города,
+    поэтому отдаётся с ETag по версии данных и долго кэшируется.
+    """
+    if not any(city["id"] == city_id for city in get_cities_cached()):
+        return jsonify({"message": f"Город с ID {city_id} не найден."}), 404
+
+    hex_format = parse_hex_format(request.args, "format")
+    if hex_format is None:
+        return jsonify({"message": f"Допустимые форматы: {', '.join(HEX_FORMATS)}."}), 400
+
+    version = cache.data_versions.get(city_id)
+    return get_hexes_body(city_id, hex_format).response(
+        etag=f"hexes-{HEXES_LAYER_VERSION}-{hex_format}-{city_id}-v{version}",
+        cache_control=f"public, max-age={current_app.config['HEXES_MAX_AGE']}",
+    )
+
+
+@cached("bound_body", max_bytes=128 * MB, tags=("city_id",))
+def get_bound_body(city_id, detail):
+    return EncodedBody.from_json(
+        get_bound(city_id, detail), current_app.config["RESPONSE_ENCODINGS"]
+    )
+
+
+@main_bp.route("/api/cities/<int:city_id>/bounds", methods=["GET"])
+def get_city_bounds(city_id):
+    """Граница города с детализацией detail (full, medium, light)"""
+    detail = request.args.get("detail", "full").lower()
+    if detail not in BOUND_DETAILS:
+        return jsonify({"message": f"Допустимые detail: {', '.join(BOUND_DETAILS)}."}), 400
+    if get_bounds(city_id) is None:
+        return jsonify({"message": f"Граница города с ID {city_id} не найдена."}), 404
+
+    version = cache.data_versions.get(city_id)
+    return get_bound_body(city_id, detail).response(
+        etag=f"bounds-{detail}-{city_id}-v{version}",
+        cache_control=f"public, max-age={current_app.config['HEXES_MAX_AGE']}",
+    )
+
+
+@cached("tiles", max_bytes=256 * MB, tags=("city_id", "category_id"))
+def get_tile_body(layer, z, x, y, city_id, category_id=None, rent=None):
+    return EncodedBody(
+        tiles.render_tile(layer, z, x, y, city_id, category_id, rent),
+        current_app.config["RESPONSE_ENCODINGS"],
+        mimetype=tiles.MVT_MIMETYPE,
+    )
+
+
+@main_bp.route("/tiles/<layer>/<int:z>/<int:x>/<int:y>.mvt", methods=["GET"])
+def get_tile(layer, z, x, y):
+    """
+    Векторные тайлы слоёв hexes, competitors (нужен category_id) и rentals
+    (необязательный rent - максимальная цена) для города city_id.
+    Слои competitors и rentals - только для вошедших пользователей.
+    """
+    if layer not in tiles.LAYER_QUERIES or not tiles.valid_tile(z, x, y):
+        return jsonify({"message": "Тайл не найден."}), 404
+    public = layer in tiles.PUBLIC_LAYERS
+    if not public and not current_user.is_authenticated:
+        return current_app.login_manager.unauthorized()
+
+    try:
+        city_id = int(request.args["city_id"])
+        category_id = request.args.get("category_id")
+        category_id = int(category_id) if category_id is not None else None
+        rent = request.args.get("rent")
+        rent = int(rent) if rent is not None else None
+    except (KeyError, ValueError):
+        return jsonify({"message": "Нужен целый city_id; category_id и rent - целые."}), 400
+    if "category_id" in tiles.LAYER_FILTERS[layer] and category_id is None:
+        return jsonify({"message": "Для слоя competitors нужен category_id."}), 400
+
+    # Лишние фильтры не должны плодить записи кэша
+    filters = {
+        name: value
+        for name, value in (("category_id", category_id), ("rent", rent))
+        if name in tiles.LAYER_FILTERS[layer]
+    }
+    version = cache.data_versions.get(city_id)
+    etag = "-".join(
+        str(part) for part in ("tile", layer, z, x, y, city_id, *filters.values())
+    )
+    return get_tile_body(layer, z, x, y, city_id, **filters).response(
+        etag=f"{etag}-v{version}",
+        cache_control=(
+            f"{'public' if public else 'private'}, "
+            f"max-age={current_app.config['TILES_MAX_AGE']}"
+        ),
+    )
+
+
+def stream_points(layer, filter_names):
+    """
+    Точки слоя в окне карты построчно в NDJSON. Параметры: city_id, bbox
+    (west,south,east,north), limit, after - id последней точки прошлой страницы.
+    """
+    try:
+        city_id = int(request.args["city_id"])
+        filters = {}
+        for name in filter_names:
+            value = request.args.get(name)
+            filters[name] = int(value) if value is not None else None
+        after = int(request.args.get("after", 0))
+        limit = int(request.args.get("limit", points.DEFAULT_LIMIT))
+        bbox = request.args.get("bbox")
+        bbox = points.parse_bbox(bbox) if bbox else None
+    except (KeyError, ValueError):
+        return (
+            jsonify(
+                {
+                    "message": "Нужен целый city_id; after, limit и фильтры - целые, "
+                    "bbox - west,south,east,north."
+                }
+            ),
+            400,
+        )
+    if not 1 <= limit <= points.MAX_LIMIT:
+        return jsonify({"message": f"limit должен быть от 1 до {points.MAX_LIMIT}."}), 400
+
+    rows = points.iter_points(layer, city_id, bbox, after, limit, **filters)
+    lines = (compact_json(row) + "\n" for row in rows)
+    return Response(stream_with_context(lines), mimetype=points.NDJSON_MIMETYPE)
+
+
+@main_bp.route("/api/competitors", methods=["GET"])
+@login_required
+def get_competitors_page():
+    """Конкуренты категории category_id в окне bbox, постранично по id"""
+    if "category_id" not in request.args:
+        return jsonify({"message": "Нужен category_id."}), 400
+    return stream_points("competitors", ("category_id",))
+
+
+@main_bp.route("/api/rentals", methods=["GET"])
+@login_required
+def get_rentals_page():
+    """Объявления аренды (rent - максимальная цена) в окне bbox, постранично по id"""
+    return stream_points("rentals", ("rent",))
+
+
+def parse_analysis_options(args):
+    """
+    Параметры ответа анализа (hex_format, detail, cluster) ->
+    ((hex_format, bound_detail, clusters), None) или (None, сообщение об ошибке)
+    """
+    hex_format = parse_hex_format(args, "hex_format")
+    if hex_format is None:
+        return None, f"Допустимые форматы: {', '.join(HEX_FORMATS)}."
+    if args.get("include_hexes", "1").lower() in ("0", "false"):
+        hex_format = None
+    bound_detail = args.get("detail", DEFAULT_ANALYSIS_BOUND_DETAIL).lower()
+    if bound_detail not in BOUND_DETAILS:
+        return None, f"Допустимые detail: {', '.join(BOUND_DETAILS)}."
+    # cluster=<zoom>: масштабы одной полосы дают одно разрешение и одну запись кэша
+    clusters = None
+    if "cluster" in args:
+        try:
+            zoom = int(args["cluster"])
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= tiles.MAX_ZOOM:
+            return None, f"cluster - масштаб от 0 до {tiles.MAX_ZOOM}."
+        clusters = cluster_resolution(zoom)
+    return (hex_format, bound_detail, clusters), None
+
+
 @main_bp.route("/api/analysis", methods=["GET"])
 @login_required
 def get_analysis():
@@ -316,17 +721,37 @@ def get_analysis():
     current_app.logger.info(
         f"User ID: {current_user.id}, City ID: {city_id}, Category ID: {category_id}"
     )
-    city = db.session.get(City, city_id)
-    if not city:
+    options, message = parse_analysis_options(request.args)
+    if message:
+        return jsonify({"message": message}), 400
+    hex_format, bound_detail, clusters = options
+
+    # Загрузка входных данных - только для запроса с верными параметрами
+    found = get_analysis_inputs(city_id, category_id)
+    if not found["city"]:
         return jsonify({"message": f"Город с ID {city_id} не найден."}), 404
 
-    category = db.session.get(Category, category_id)
-    if not category:
+    if not found["category"]:
         return jsonify({"message": f"Категория с ID {category_id} не найдена."}), 404
 
-    result = compute_analysis(
-        city_id, category_id, radius_km, rent_limit, max_competitors_count, n_areas
-    )
+    try:
+        body = get_analysis_body(
+            city_id,
+            category_id,
+            radius_km,
+            rent_limit,
+            max_competitors_count,
+            n_areas,
+            hex_format,
+            bound_detail,
+            clusters,
+        )
+    except TimeoutError as e:
+        current_app.logger.warning(f"Analysis wait timed out: {e}")
+        return (
+            jsonify({"message": "Анализ ещё выполняется, повторите запрос позже."}),
+            503,
+        )
 
     try:
         history_entry = AnalysisRequest(
@@ -346,7 +771,7 @@ def get_analysis():
             f"Failed to save analysis history for user {current_user.id}: {e}"
         )
 
-    return jsonify(result)
+    return body.response()
 
 
 @login_manager.unauthorized_handler
@@ -440,15 +865,14 @@ def me():
 from sqlalchemy import func
 
 
-@lru_cache(maxsize=128)
+@cached("competitors", max_bytes=256 * MB, tags=("city_id", "category_id"))
 def get_competitors(city_id, category_id):
     from app.models import Organization, Category
     from sqlalchemy import func
 
     """Получение конкурентов в заданном радиусе"""
     query = db.session.query(
-        func.ST_Y(Organization.coordinates).label("lat"),
-        func.ST_X(Organization.coordinates).label("lon"),
+        func.ST_AsBinary(Organization.coordinates).label("wkb"),
         Organization.name,
         Organization.rate,
         Organization.rate_count,
@@ -456,21 +880,24 @@ def get_competitors(city_id, category_id):
     ).filter(
         Organization.city_id == city_id,
         Organization.categories.any(Category.id == category_id),
-        
+        Organization.coordinates.isnot(None),
     )
 
-    competitors_data = query.all()
+    return build_competitors(with_coordinates(query.all()))
+
 
+def build_competitors(rows):
+    """Строки (lat, lon, name, rate, rate_count, strength) -> словари конкурентов"""
     result = []
-    for comp_data in competitors_data:
+    for lat, lon, name, rate, rate_count, strength in rows:
         try:
             result.append(
                 {
-                    "coordinates": [comp_data.lat, comp_data.lon],
-                    "name": comp_data.name,
-                    "strength": comp_data.strength,
-                    'rate': comp_data.rate,
-                    'rate_count':comp_data.rate_count
+                    "coordinates": [lat, lon],
+                    "name": name,
+                    "strength": strength,
+                    'rate': rate,
+                    'rate_count': rate_count
                 }
             )
         except Exception as e:
@@ -480,133 +907,235 @@ def get_competitors(city_id, category_id):
     return result
 
 
-@lru_cache(maxsize=32)
-def get_rental_places(city_id, rent_limit):
+@cached("rental_index", max_bytes=128 * MB, tags=("city_id",))
+def get_rental_index(city_id):
+    """Все объявления аренды города, один запрос на город"""
     from app.models import CianListing
     from sqlalchemy import func
-    from flask import current_app
 
-    """Получение мест аренды в заданном радиусе"""
     query = db.session.query(
-        func.ST_Y(CianListing.coordinates).label("lat"),
-        func.ST_X(CianListing.coordinates).label("lon"),
+        func.ST_AsBinary(CianListing.coordinates).label("wkb"),
         CianListing.cian_id,
         CianListing.price,
         CianListing.total_area,
     ).filter(
         CianListing.city_id == city_id,
-        CianListing.price <= rent_limit,
+        CianListing.price.isnot(None),
     )
 
-    rent_data = query.all()
+    return build_rental_index(with_coordinates(query.all()))
 
+
+def build_rental_index(rows):
+    """Строки (lat, lon, cian_id, price, total_area) -> RentalIndex"""
     result = []
-    for rental in rent_data:
+    for lat, lon, cian_id, price, total_area in rows:
         try:
             result.append(
                 {
-                    "id": rental.cian_id,
-                    "coordinates": [rental.lat, rental.lon],
-                    "price": rental.price,
-                    "total_area": rental.total_area,
+                    "id": cian_id,
+                    "coordinates": [lat, lon],
+                    "price": price,
+                    "total_area": total_area,
                 }
             )
         except Exception as e:
             current_app.logger.warning(
-                f"Ошибка при обработке аренды ID={rental.cian_id}: {e}"
+                f"Ошибка при обработке аренды ID={cian_id}: {e}"
             )
             continue
 
-    return result
+    return RentalIndex(result)
+
+
+@cached("rental_clusters", max_bytes=64 * MB, tags=("city_id",))
+def get_rental_clusterer(city_id, resolution):
+    """Объявления города по клеткам H3 в порядке индекса аренды (по цене)"""
+    return PointClusters.from_points(
+        get_rental_index(city_id).places, "price", resolution
+    )
+
+
+def get_rental_clusters(city_id, rent_limit, resolution):
+    """Кластеры объявлений не дороже rent_limit: префикс отсортированных по цене"""
+    count = get_rental_index(city_id).count(rent_limit)
+    return get_rental_clusterer(city_id, resolution).rental_clusters(count)
+
+
+@cached("competitor_clusters", max_bytes=64 * MB, tags=("city_id", "category_id"))
+def get_competitor_clusters(city_id, category_id, resolution):
+    """Кластеры конкурентов: число и суммарная сила по клеткам H3"""
+    return PointClusters.from_points(
+        get_competitors(city_id, category_id), "strength", resolution
+    ).competitor_clusters()
 
 
 import json
 
 
-@lru_cache(maxsize=32)
-def get_hexs(city_id):
+@cached("hex_layer", max_bytes=128 * MB, tags=("city_id",))
+def get_hex_layer(city_id):
+    """
+    Компактный слой гексагонов: id клеток H3 и население параллельными
+    массивами. Геометрия из PostGIS не читается - она однозначно задаётся id.
+    """
     from app.models import Hexagon
-    from sqlalchemy import func
-    from flask import current_app
 
-    query = db.session.query(
-        Hexagon.population,
-        Hexagon.id.label("hex_id"),
-        func.ST_AsGeoJSON(Hexagon.geometry).label("geometry_geojson_str"),
-    ).filter(Hexagon.city_id == city_id)
+    rows = (
+        db.session.query(Hexagon.id, Hexagon.population)
+        .filter(Hexagon.city_id == city_id)
+        .order_by(Hexagon.id)
+        .all()
+    )
+    return build_hex_layer([row.id for row in rows], [row.population for row in rows])
 
-    hex_rows = query.all()
-    features = []
-    populations_for_stats = []
 
-    for row in hex_rows:
-        try:
-            geometry_dict = json.loads(row.geometry_geojson_str)
+def build_hex_layer(ids, pops):
+    """Компактный слой по id клеток и населению (max/total считаются здесь же)"""
+    known = [pop for pop in pops if pop is not None]  # Для корректного расчета max/sum
 
-            features.append(
-                {
-                    "type": "Feature",
-                    "geometry": geometry_dict,
-                    "properties": {
-                        "pop": row.population,
-                        "hex_id": row.hex_id,
-                    },
-                }
-            )
-            if row.population is not None:  # Для корректного расчета max/sum
-                populations_for_stats.append(row.population)
-        except Exception as e:
-            current_app.logger.error(
-                f"Ошибка при обработке гексагона (id: {row.hex_id if hasattr(row, 'hex_id') else 'N/A'}): {e}"
-            )
+    return {
+        "ids": ids,
+        "pop": pops,
+        "max": max(known, default=0),
+        "total": sum(known),
+    }
+
+
+def hex_geometry(hex_id):
+    """GeoJSON-полигон клетки H3 (как ST_AsGeoJSON от city_hexagons.geom)"""
+    ring = [[lng, lat] for lat, lng in h3.cell_to_boundary(hex_id)]
+    ring.append(ring[0])
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+@cached("hexs", max_bytes=512 * MB, tags=("city_id",))
+def get_hexs(city_id):
+    """Слой гексагонов в GeoJSON: границы строятся по id клеток"""
+    from flask import current_app
+
+    layer = get_hex_layer(city_id)
+    features = []
+    for hex_id, pop in zip(layer["ids"], layer["pop"]):
+        try:
+            geometry = hex_geometry(hex_id)
+        except h3.H3BaseException as e:
+            current_app.logger.error(f"Ошибка при обработке гексагона (id: {hex_id}): {e}")
             continue
 
-    stats_query = db.session.query(
-        func.max(Hexagon.population).label("max_pop"),
-        func.sum(Hexagon.population).label("total_pop"),
-    ).filter(Hexagon.city_id == city_id)
-    stats_result = stats_query.one()
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": geometry,
+                "properties": {
+                    "pop": pop,
+                    "hex_id": hex_id,
+                },
+            }
+        )
 
-    geojson_result = {
+    return {
         "type": "FeatureCollection",
         "features": features,
-        "max": (
-            stats_result.max_pop
-            if stats_result and stats_result.max_pop is not None
-            else 0
-        ),
-        "total": (
-            stats_result.total_pop
-            if stats_result and stats_result.total_pop is not None
-            else 0
-        ),
+        "max": layer["max"],
+        "total": layer["total"],
     }
 
-    return geojson_result
-
 
-@lru_cache(maxsize=32)
-def get_bound(city_id):
+@cached("bounds", max_bytes=128 * MB, tags=("city_id",))
+def get_bounds(city_id):
+    """
+    Граница города на всех уровнях детализации BOUND_DETAILS, одним запросом.
+    Возвращает {detail: Feature} или None, если границы нет.
+    """
     from app.models import CityBound
     from sqlalchemy import func
-    import json
 
-    bound_geojson_str = (
-        db.session.query(func.ST_AsGeoJSON(CityBound.geometry))
-        .filter(CityBound.city_id == city_id)
-        .scalar()
-    )
+    columns = []
+    for tolerance, precision in BOUND_DETAILS.values():
+        geometry = CityBound.geometry
+        if tolerance:
+            geometry = func.ST_SimplifyPreserveTopology(geometry, tolerance)
+        columns.append(func.ST_AsGeoJSON(geometry, precision))
+
+    row = db.session.query(*columns).filter(CityBound.city_id == city_id).first()
+    return build_bounds(city_id, row)
+
 
-    if not bound_geojson_str:
+def build_bounds(city_id, geojson_strs):
+    """GeoJSON-строки по уровням BOUND_DETAILS -> {detail: Feature} или None"""
+    if not geojson_strs or geojson_strs[0] is None:
         return None
 
     return {
-        "type": "Feature",
-        "geometry": json.loads(bound_geojson_str),
-        "properties": {"city_id": city_id},
+        detail: {
+            "type": "Feature",
+            "geometry": json.loads(geojson_str),
+            "properties": {"city_id": city_id, "detail": detail},
+        }
+        for detail, geojson_str in zip(BOUND_DETAILS, geojson_strs)
     }
 
 
+@cached("analysis_inputs", max_bytes=1 * MB, tags=("city_id", "category_id"))
+def get_analysis_inputs(city_id, category_id):
+    """
+    Входные данные анализа одним запросом к БД вместо отдельных запросов на
+    город, категорию, конкурентов, аренду, гексагоны и границу. Прочитанные
+    части кладутся в кэши своих загрузчиков; части, уже лежащие в кэше, не
+    запрашиваются. Возвращает {"city": найден ли, "category": найдена ли}.
+    """
+    missing = missing_analysis_inputs(city_id, category_id)
+    row = inputs.fetch_inputs(city_id, category_id, list(missing), BOUND_DETAILS)
+    return prime_analysis_inputs(city_id, category_id, row, missing)
+
+
+def prime_analysis_inputs(city_id, category_id, row, missing):
+    """
+    Раскладывает прочитанные столбцы частей missing ({имя: (загрузчик,
+    аргументы)}) по кэшам загрузчиков. row - столбцы inputs.fetch_inputs
+    (или объединение EXISTS_QUERY и запросов частей). Возвращает
+    {"city": найден ли, "category": найдена ли}.
+    """
+    found = {"city": row["city_found"], "category": row["category_found"]}
+    if not (found["city"] and found["category"]):
+        return found
+
+    def column(name):
+        return row.get(name) or []
+
+    built = {
+        "competitors": lambda: build_competitors(
+            zip(
+                *(
+                    column(f"comp_{name}")
+                    for name in ("lat", "lon", "name", "rate", "rate_count", "strength")
+                )
+            )
+        ),
+        "rentals": lambda: build_rental_index(
+            zip(
+                *(
+                    column(f"rent_{name}")
+                    for name in ("lat", "lon", "id", "price", "total_area")
+                )
+            )
+        ),
+        "hexes": lambda: build_hex_layer(column("hex_ids"), column("hex_pops")),
+        "bounds": lambda: build_bounds(
+            city_id, [row.get(f"bound_{detail}") for detail in BOUND_DETAILS]
+        ),
+    }
+    for name, (loader, args) in missing.items():
+        loader.prime(built[name](), *args)
+    return found
+
+
+def get_bound(city_id, detail="full"):
+    bounds = get_bounds(city_id)
+    return bounds[detail] if bounds else None
+
+
 # Расчет средней аренды
 def calculate_avg_rent(rent_places):
     if not rent_places:
@@ -626,6 +1155,7 @@ def calculate_avg_cost_for_square(rent_places):
 
 
 from collections import defaultdict
+import heapq
 
 
 def find_top_zones(hexs, orgs, resolution, radius_m, max_comp, n):
@@ -647,16 +1177,12 @@ def find_top_zones(hexs, orgs, resolution, radius_m, max_comp, n):
     cell_distance = edge_m * math.sqrt(3)
     k = math.ceil(((radius_m-cell_distance/2) / cell_distance))
 
-    @lru_cache(maxsize=8192)
-    def cached_grid_disk(cell, k):
-        return set(h3.grid_disk(cell, k))
-
-    neighbor_map = {cell: cached_grid_disk(cell, k) for cell in hex_ids}
-
-    # 3. Генерация всех кандидатов
-    candidates = []
-    for cell in hex_ids:
-        neighbors = neighbor_map[cell]
+    # 3. Оценка всех кандидатов: в куче только (-score, индекс клетки),
+    # множества соседей и центры строятся лишь для выбранных зон
+    heap = []
+    sums = {}
+    for i, cell in enumerate(hex_ids):
+        neighbors = h3.grid_disk(cell, k)
         pop_sum = sum(pop_by_cell.get(c, 0) for c in neighbors)
         comp_strength = sum(strength_by_cell.get(c, 0) for c in neighbors)
         comp_count = sum(count.get(c, 0) for c in neighbors)
@@ -665,35 +1191,129 @@ def find_top_zones(hexs, orgs, resolution, radius_m, max_comp, n):
             continue
         alpha = 0.01
         score = pop_sum / (1 + alpha * avg_strength)
-        lat, lon = h3.cell_to_latlng(cell)
-        candidates.append(
-            {
-                "cell": cell,
-                "neighbors": neighbors,
-                "pop_sum": pop_sum,
-                "comp_count": comp_count,
-                "comp_strength": comp_strength,
-                "score": score,
-                "center": [lat, lon],
-            }
-        )
+        # индекс i разрешает равные оценки в исходном порядке клеток
+        heap.append((-score, i))
+        sums[i] = (pop_sum, comp_count, comp_strength)
 
-    candidates.sort(key=lambda x: x["score"], reverse=True)
+    heapq.heapify(heap)
+    position = {cell: i for i, cell in enumerate(hex_ids)}
+    covered = bytearray(len(hex_ids))
     selected = []
-    covered = set()
-    for cand in candidates:
-        if cand["cell"] in covered:
+    while heap and len(selected) < n:
+        _, i = heapq.heappop(heap)
+        if covered[i]:
             continue
+        cell = hex_ids[i]
+        pop_sum, comp_count, comp_strength = sums[i]
+        lat, lon = h3.cell_to_latlng(cell)
         selected.append(
             {
-                "comp_count": int(cand["comp_count"]),
-                "center": [float(cand["center"][0]), float(cand["center"][1])],
-                "pop_sum": int(cand["pop_sum"]),
-                "comp_strength": float(cand["comp_strength"]),
+                "comp_count": int(comp_count),
+                "center": [float(lat), float(lon)],
+                "pop_sum": int(pop_sum),
+                "comp_strength": float(comp_strength),
             }
         )
-        covered |= cand["neighbors"]
-        if len(selected) >= n:
-            break
+        for c in h3.grid_disk(cell, k):
+            j = position.get(c)
+            if j is not None:
+                covered[j] = 1
 
     return selected
+
+
+from .zones import (
+    cell_arrays,
+    org_arrays,
+    grid_k,
+    grid_radius_m,
+    score_zones_numpy,
+    score_zones_ij,
+    competitor_cell_arrays,
+)
+from .zones_postgis import PostgisZones
+
+
+@cached("hex_cells", max_bytes=64 * MB, tags=("city_id",))
+def get_hex_cells(city_id):
+    """Гексагоны города как (uint64-клетки H3, население)"""
+    layer = get_hex_layer(city_id)
+    return cell_arrays(layer["ids"], layer["pop"])
+
+
+@cached("competitor_cells", max_bytes=64 * MB, tags=("city_id", "category_id"))
+def get_competitor_cells(city_id, category_id, resolution):
+    """
+    Конкуренты как (uint64-клетки H3 разрешения resolution, сила, число
+    организаций). Берутся из таблицы competitor_cells, сведённой сборщиком;
+    без неё (COMPETITOR_CELLS=0, таблица недоступна или ещё не заполнена для
+    города и категории) клетки считаются по строкам организаций, а число -
+    None (каждая строка - одна организация).
+    """
+    from app.models import CompetitorCell
+
+    if current_app.config.get("COMPETITOR_CELLS"):
+        try:
+            rows = (
+                db.session.query(
+                    CompetitorCell.h3_cell,
+                    CompetitorCell.strength_sum,
+                    CompetitorCell.org_count,
+                )
+                .filter(
+                    CompetitorCell.city_id == city_id,
+                    CompetitorCell.category_id == category_id,
+                    CompetitorCell.resolution == resolution,
+                )
+                .all()
+            )
+            # Нет строк - сборщик ещё не свёл этот город и категорию
+            if rows:
+                return competitor_cell_arrays(rows)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(f"Таблица competitor_cells недоступна: {e}")
+
+    return (*org_arrays(get_competitors(city_id, category_id), resolution), None)
+
+
+class ReferenceZones:
+    """Эталонный find_top_zones за интерфейсом ScoredZones (без кэша оценок)"""
+
+    def __init__(self, hexs, orgs, resolution, k):
+        self.hexs = hexs
+        self.orgs = orgs
+        self.resolution = resolution
+        self.radius_m = grid_radius_m(resolution, k)
+
+    def select(self, max_comp, n):
+        return find_top_zones(
+            self.hexs, self.orgs, self.resolution, self.radius_m, max_comp, n
+        )
+
+
+def score_zones_python(
+    hex_cells, hex_pop, org_cells, org_strength, resolution, k, cache_key=None,
+    org_count=None,
+):
+    hexs = [
+        {"hex_id": h3.int_to_str(int(cell)), "pop": int(pop)}
+        for cell, pop in zip(hex_cells, hex_pop)
+    ]
+    if org_count is None:
+        org_count = [1] * len(org_cells)
+    orgs = []
+    for cell, s, count in zip(org_cells, org_strength, org_count):
+        # Сведённая клетка: вся сила у первой организации, остальные с нулевой
+        center = h3.cell_to_latlng(h3.int_to_str(int(cell)))
+        orgs.append({"coordinates": center, "strength": float(s)})
+        orgs.extend({"coordinates": center, "strength": 0.0} for _ in range(int(count) - 1))
+    return ReferenceZones(hexs, orgs, resolution, k)
+
+
+# Движки оценки зон, выбираются через ZONES_ENGINE (ещё postgis - см. get_scored_zones)
+ZONE_SCORERS = {
+    "python": score_zones_python,
+    "numpy": score_zones_numpy,
+    "ij": score_zones_ij,
+}
@@ -0,0 +1,247 @@
+import atexit
+import concurrent.futures
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .zones import score_zones_ij, score_zones_numpy
+
+# Движки, которые можно выполнять в процессах пула (чистый NumPy/H3)
+ENGINES = {
+    "numpy": score_zones_numpy,
+    "ij": score_zones_ij,
+}
+
+# Сколько наборов массивов держать в общей памяти (родитель) и сколько
+# подключений и оценённых кандидатов держать в каждом процессе пула
+SHARED_MAX = 64
+WORKER_ARRAYS_MAX = 128
+WORKER_SCORED_MAX = 16
+
+executor = None
+processes = 0
+slots = None  # ограничение числа задач в пуле (очередь + выполняемые)
+timeout = None
+restart_lock = threading.Lock()
+
+
+class SharedArrays:
+    """
+    Массивы городов в общей памяти: родитель кладёт их один раз на ключ
+    (город/категория и версия данных), процессы пула подключаются по имени
+    без копирования и сериализации. Старые наборы удаляются по LRU, но не
+    раньше, чем закончатся задачи, получившие на них ссылки.
+    """
+
+    def __init__(self, max_entries=SHARED_MAX):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # ключ -> [блоки, ссылки, число задач]
+        self.lock = threading.Lock()
+
+    def acquire(self, key, arrays):
+        """
+        Ссылки (имя, dtype, shape) на копии arrays в общей памяти; None
+        остаётся None. Набор закреплён до парного вызова release(key).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                entry[2] += 1
+                return entry[1]
+
+            blocks, refs = [], []
+            for array in arrays:
+                if array is None:
+                    refs.append(None)
+                    continue
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+                blocks.append(block)
+                refs.append((block.name, array.dtype.str, array.shape))
+
+            self.entries[key] = [blocks, refs, 1]
+            self._evict()
+            return refs
+
+    def release(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[2] -= 1
+                self._evict()
+
+    def _evict(self):
+        """Удаляет самые старые незакреплённые наборы сверх max_entries"""
+        extra = len(self.entries) - self.max_entries
+        if extra <= 0:
+            return
+        unused = [key for key, entry in self.entries.items() if entry[2] <= 0]
+        for key in unused[:extra]:
+            release(self.entries.pop(key)[0])
+
+    def clear(self):
+        with self.lock:
+            for blocks, _, _ in self.entries.values():
+                release(blocks)
+            self.entries.clear()
+
+
+def release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+shared = SharedArrays()
+
+# --- В процессах пула ---
+
+_attached = OrderedDict()
+_scored = OrderedDict()
+
+
+def attach(ref):
+    """Массив из общей памяти родителя (подключение кэшируется в процессе)"""
+    if ref is None:
+        return None
+    name, dtype, shape = ref
+    entry = _attached.get(name)
+    if entry is None:
+        block = shared_memory.SharedMemory(name=name)
+        # Блоком владеет родитель: трекер процесса пула не должен его удалять
+        resource_tracker.unregister(block._name, "shared_memory")
+        entry = (block, np.ndarray(shape, np.dtype(dtype), buffer=block.buf))
+        _attached[name] = entry
+        while len(_attached) > WORKER_ARRAYS_MAX:
+            _, (old_block, _) = _attached.popitem(last=False)
+            try:
+                old_block.close()
+            except BufferError:  # массив ещё где-то используется
+                pass
+    _attached.move_to_end(name)
+    return entry[1]
+
+
+def top_zones_task(key, refs, engine, resolution, k, max_comp, n):
+    """Оценка (с кэшем в процессе по key) и жадный выбор зон"""
+    scored = _scored.get(key)
+    if scored is None:
+        hex_cells, hex_pop, org_cells, org_strength, org_count = map(attach, refs)
+        scored = ENGINES[engine](
+            hex_cells, hex_pop, org_cells, org_strength, resolution, k,
+            cache_key=key[0], org_count=org_count,
+        )
+        _scored[key] = scored
+        while len(_scored) > WORKER_SCORED_MAX:
+            _scored.popitem(last=False)
+    _scored.move_to_end(key)
+    return scored.select(max_comp, n)
+
+
+# --- В процессе приложения ---
+
+
+def enabled(engine):
+    return executor is not None and engine in ENGINES
+
+
+def top_zones(key, hex_arrays, org_arrays, engine, resolution, k, max_comp, n):
+    """
+    Выбор зон в пуле процессов. key - (city_id, category_id, k, версия данных).
+    Если в пуле уже SCORING_QUEUE задач или ответ не пришёл за SCORING_TIMEOUT
+    секунд, бросает TimeoutError - тяжёлые анализы не копятся бесконечно.
+    Если процесс пула умер, пул пересоздаётся, а вызывающему уходит
+    BrokenProcessPool: этот запрос он оценивает сам.
+    """
+    queue, pool = slots, executor
+    if not queue.acquire(blocking=False):
+        raise TimeoutError("Очередь оценки зон переполнена")
+    city_id, category_id, _, version = key
+    shared_keys = [("hexes", city_id, version), ("orgs", city_id, category_id, version)]
+    acquired = []
+
+    def done(_):
+        # Место в очереди и наборы в общей памяти освобождаются, когда задача
+        # действительно закончилась
+        for shared_key in acquired:
+            shared.release(shared_key)
+        queue.release()
+
+    try:
+        refs = []
+        for shared_key, arrays in zip(shared_keys, (hex_arrays, org_arrays)):
+            refs += shared.acquire(shared_key, arrays)
+            acquired.append(shared_key)
+        future = pool.submit(top_zones_task, key, refs, engine, resolution, k, max_comp, n)
+    except BrokenProcessPool:
+        done(None)
+        restart(pool)
+        raise
+    except Exception:
+        done(None)
+        raise
+    future.add_done_callback(done)
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        raise TimeoutError(f"Оценка зон {key!r} не уложилась в {timeout} с")
+    except BrokenProcessPool:
+        restart(pool)
+        raise
+
+
+def start():
+    global executor
+    # spawn: дочерние процессы не наследуют потоки и соединения родителя
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def restart(broken):
+    """Новый пул вместо сломанного (один раз, сколько бы запросов ни упало)"""
+    with restart_lock:
+        if executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        start()
+
+
+def shutdown():
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+    shared.clear()
+
+
+def init_app(app):
+    global processes, slots, timeout
+    shutdown()
+    processes = app.config.get("SCORING_PROCESSES", 0)
+    if processes <= 0:
+        return
+    start()
+    slots = threading.BoundedSemaphore(app.config.get("SCORING_QUEUE") or 2 * processes)
+    timeout = app.config.get("SCORING_TIMEOUT", 20)
+
+
+def after_fork(app):
+    """
+    В дочернем процессе: пул и блоки общей памяти родителя не трогаем
+    (ими владеет родитель), создаём свой пул
+    """
+    global executor
+    executor = None
+    with shared.lock:
+        shared.entries.clear()
+    init_app(app)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,88 @@
+from sqlalchemy import text
+
+from .extensions import db
+
+MAX_ZOOM = 22
+MVT_MIMETYPE = "application/vnd.mapbox-vector-tile"
+
+# Фильтры по охвату тайла сформулированы как ST_Transform(..., 3857) && тайл,
+# чтобы использовались GiST-индексы по выражению в 3857
+LAYER_QUERIES = {
+    "hexes": """
+        WITH bounds AS (SELECT ST_TileEnvelope(:z, :x, :y) AS geom),
+        tile AS (
+            SELECT
+                ST_AsMVTGeom(ST_Transform(h.geom, 3857), bounds.geom) AS geom,
+                h.id AS hex_id,
+                h.population AS pop
+            FROM city_hexagons h, bounds
+            WHERE h.city_id = :city_id
+              AND ST_Transform(h.geom, 3857) && bounds.geom
+        )
+        SELECT ST_AsMVT(tile.*, 'hexes') FROM tile
+    """,
+    "competitors": """
+        WITH bounds AS (SELECT ST_TileEnvelope(:z, :x, :y) AS geom),
+        tile AS (
+            SELECT
+                ST_AsMVTGeom(ST_Transform(o.coordinates, 3857), bounds.geom) AS geom,
+                o.id,
+                o.name,
+                o.rate,
+                o.rate_count,
+                o.strength,
+                o.address
+            FROM organizations o
+            JOIN organization_categories oc ON oc.organization_id = o.id
+            CROSS JOIN bounds
+            WHERE o.city_id = :city_id
+              AND oc.category_id = :category_id
+              AND ST_Transform(o.coordinates, 3857) && bounds.geom
+        )
+        SELECT ST_AsMVT(tile.*, 'competitors') FROM tile
+    """,
+    "rentals": """
+        WITH bounds AS (SELECT ST_TileEnvelope(:z, :x, :y) AS geom),
+        tile AS (
+            SELECT
+                ST_AsMVTGeom(ST_Transform(c.coordinates, 3857), bounds.geom) AS geom,
+                c.cian_id AS id,
+                c.price,
+                c.total_area
+            FROM cian_listings c, bounds
+            WHERE c.city_id = :city_id
+              AND (CAST(:rent AS integer) IS NULL OR c.price <= :rent)
+              AND ST_Transform(c.coordinates, 3857) && bounds.geom
+        )
+        SELECT ST_AsMVT(tile.*, 'rentals') FROM tile
+    """,
+}
+
+# Параметры фильтров слоя, кроме city_id (обязателен для всех)
+LAYER_FILTERS = {
+    "hexes": (),
+    "competitors": ("category_id",),
+    "rentals": ("rent",),
+}
+
+# Слои без авторизации (как /api/cities/<id>/hexes); данные организаций и
+# объявлений, как и в /api/analysis, - только для вошедших пользователей
+PUBLIC_LAYERS = ("hexes",)
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def render_tile(layer, z, x, y, city_id, category_id=None, rent=None):
+    """Тайл слоя в формате MVT (байты, пустые - если в тайле ничего нет)"""
+    params = {
+        "z": z,
+        "x": x,
+        "y": y,
+        "city_id": city_id,
+        "category_id": category_id,
+        "rent": rent,
+    }
+    tile = db.session.execute(text(LAYER_QUERIES[layer]), params).scalar()
+    return bytes(tile) if tile else b""
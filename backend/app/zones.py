@@ -0,0 +1,424 @@
+import math
+
+import h3
+import h3.api.numpy_int as h3int
+import numpy as np
+from scipy import sparse
+
+from .cache import MB, SizedCache, caches
+
+# Коэффициент штрафа за силу конкурентов в формуле оценки зоны
+ALPHA = 0.01
+
+# Сколько байт матриц соседства держать в памяти процесса (город x разрешение x k):
+# для города в 30 тыс. клеток при k=15 одна матрица занимает около 100 МБ
+NEIGHBOR_INDEX_MAX_BYTES = 512 * MB
+
+# Размер первой порции лучших кандидатов при жадном выборе (далее растёт в 4 раза)
+SELECT_CHUNK_MIN = 256
+
+# Сколько клеток за раз разворачивать в grid_disk при построении соседства
+DISK_BLOCK = 1024
+
+
+def cell_distance_m(resolution):
+    """Среднее расстояние между центрами соседних клеток"""
+    return h3.average_hexagon_edge_length(resolution, unit="m") * math.sqrt(3)
+
+
+def grid_k(resolution, radius_m):
+    """Радиус в метрах -> число колец grid_disk (как в find_top_zones)"""
+    cell_distance = cell_distance_m(resolution)
+    return math.ceil((radius_m - cell_distance / 2) / cell_distance)
+
+
+def grid_radius_m(resolution, k):
+    """Какой-нибудь радиус в метрах, для которого grid_k даёт ровно k"""
+    return (k + 0.25) * cell_distance_m(resolution)
+
+
+def cell_arrays(ids, pops):
+    """Id клеток H3 (строки) и население -> (uint64-клетки, население)"""
+    cells = np.fromiter((h3.str_to_int(i) for i in ids), dtype=np.uint64, count=len(ids))
+    pop = np.fromiter((p or 0 for p in pops), dtype=np.int64, count=len(pops))
+    return cells, pop
+
+
+def hex_arrays(hexs):
+    """Свойства гексагонов {"hex_id", "pop"} -> (uint64-клетки, население)"""
+    return cell_arrays([h["hex_id"] for h in hexs], [h["pop"] for h in hexs])
+
+
+def org_arrays(orgs, resolution):
+    """Организации {"coordinates", "strength"} -> (uint64-клетки, сила)"""
+    cells = np.fromiter(
+        (h3int.latlng_to_cell(*org["coordinates"], resolution) for org in orgs),
+        dtype=np.uint64,
+        count=len(orgs),
+    )
+    strength = np.fromiter(
+        (org.get("strength") or 0 for org in orgs), dtype=np.float64, count=len(orgs)
+    )
+    return cells, strength
+
+
+def competitor_cell_arrays(rows):
+    """Строки (h3_cell, strength_sum, org_count) -> (uint64-клетки, сила, число)"""
+    cells = np.fromiter((row[0] for row in rows), dtype=np.uint64, count=len(rows))
+    strength = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+    count = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+    return cells, strength, count
+
+
+def aggregate_cells(hex_cells, hex_pop, org_cells, org_strength, org_count=None):
+    """
+    Сводит гексагоны и организации в плотные массивы по клеткам.
+    Возвращает (cells, pop, strength, count): cells - отсортированные
+    uint64-клетки, остальные - массивы по тем же индексам.
+    org_count - число организаций за каждой записью, если организации уже
+    сведены по клеткам (по умолчанию каждая запись - одна организация).
+    """
+    cells = np.union1d(hex_cells, org_cells)
+    pop = np.zeros(len(cells), dtype=np.int64)
+    pop[np.searchsorted(cells, hex_cells)] = hex_pop
+
+    org_slots = np.searchsorted(cells, org_cells)
+    strength = np.bincount(org_slots, weights=org_strength, minlength=len(cells))
+    count = np.bincount(org_slots, weights=org_count, minlength=len(cells)).astype(np.int64)
+    return cells, pop, strength, count
+
+
+def lookup(cells, values):
+    """Индексы values в отсортированном cells и маска найденных"""
+    if not len(cells):
+        return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+    slots = np.minimum(np.searchsorted(cells, values), len(cells) - 1)
+    return slots, cells[slots] == values
+
+
+def disk_neighbors(cells, k):
+    """
+    Соседство grid_disk(cell, k) в CSR-виде над отсортированными cells:
+    соседи клетки i - indices[indptr[i]:indptr[i + 1]]. Клетки вне cells
+    отбрасываются, т.к. их вклад в суммы нулевой.
+    """
+    counts = np.zeros(len(cells), dtype=np.int64)
+    parts = []
+    for start in range(0, len(cells), DISK_BLOCK):
+        disks = [h3int.grid_disk(cell, k) for cell in cells[start : start + DISK_BLOCK]]
+        sizes = [len(disk) for disk in disks]
+        slots, inside = lookup(cells, np.concatenate(disks))
+        owners = np.repeat(np.arange(len(disks)), sizes)
+        counts[start : start + len(disks)] = np.bincount(
+            owners[inside], minlength=len(disks)
+        )
+        parts.append(slots[inside])
+
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    indices = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+    return indptr, indices
+
+
+class NeighborIndex:
+    """
+    Матрица соседства grid_disk(cell, k) в формате CSR над отсортированным
+    набором uint64-клеток. Строка i - диск клетки cells[i], поэтому суммы
+    по дискам считаются одним умножением matrix @ values.
+    """
+
+    def __init__(self, cells, k):
+        self.cells = cells
+        self.k = k
+        indptr, indices = disk_neighbors(cells, k)
+        size = len(cells)
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int8), indices.astype(np.int32), indptr),
+            shape=(size, size),
+        )
+
+    def covers(self, cells):
+        return bool(lookup(self.cells, cells)[1].all())
+
+    def slots(self, cells):
+        """Индексы клеток в матрице"""
+        return np.searchsorted(self.cells, cells)
+
+    def disk_sums(self, slots, values):
+        """Суммы values (заданных для клеток slots) по дискам этих же клеток"""
+        full = np.zeros(len(self.cells), dtype=values.dtype)
+        full[slots] = values
+        return (self.matrix @ full)[slots]
+
+    def disk_of(self, slot):
+        indptr, indices = self.matrix.indptr, self.matrix.indices
+        return indices[indptr[slot] : indptr[slot + 1]]
+
+
+# Индексы не устаревают (зависят только от клеток), вытесняются по размеру;
+# кэш виден в статистике /api/admin/cache
+_neighbor_indexes = SizedCache("neighbor_index", NEIGHBOR_INDEX_MAX_BYTES, ttl=0)
+caches[_neighbor_indexes.name] = _neighbor_indexes
+
+
+def get_neighbor_index(key, cells, k):
+    """
+    Общий для процесса индекс соседства по ключу (город, разрешение, k).
+    Если в запросе появились новые клетки (например, организации другой
+    категории вне гексагонов города), индекс перестраивается по объединению.
+    """
+    found, index = _neighbor_indexes.get(key)
+    if found and index.covers(cells):
+        return index
+
+    universe = cells if not found else np.union1d(index.cells, cells)
+    index = NeighborIndex(universe, k)
+    _neighbor_indexes.set(key, index, {("city_id", key[0])})
+    return index
+
+
+def clear_neighbor_indexes():
+    _neighbor_indexes.clear()
+
+
+def ranked(score, candidates, chunk):
+    """
+    Кандидаты по убыванию score, порциями через argpartition вместо полной
+    сортировки: обычно жадному выбору хватает первой порции.
+    Равные оценки идут в порядке индексов, как после list.sort(reverse=True).
+    """
+    keys = -score[candidates]
+    while candidates.size:
+        if candidates.size > chunk:
+            kth = np.partition(keys, chunk - 1)[chunk - 1]
+            # все равные kth попадают в одну порцию, чтобы не нарушить порядок
+            take = keys <= kth
+        else:
+            take = np.ones(candidates.size, dtype=bool)
+        part, part_keys = candidates[take], keys[take]
+        yield from part[np.argsort(part_keys, kind="stable")]
+        candidates, keys = candidates[~take], keys[~take]
+        chunk *= 4
+
+
+class ScoredZones:
+    """
+    Оценённые кандидаты одного (город, категория, k). Не зависят от
+    max_comp и n, поэтому кэшируются отдельно, а выбор зон делает select().
+    slots[i] - номер клетки cells[i] в битовой маске покрытия длины size,
+    disk_of(slot) - номера клеток её диска в той же маске.
+    """
+
+    def __init__(self, cells, slots, size, disk_of, pop_sum, comp_strength, comp_count):
+        self.cells = cells
+        self.slots = slots
+        self.size = size
+        self.disk_of = disk_of
+        self.pop_sum = pop_sum
+        self.comp_strength = comp_strength
+        self.comp_count = comp_count
+        avg_strength = comp_strength / np.maximum(comp_count, 1)
+        self.score = pop_sum / (1 + ALPHA * avg_strength)
+
+    @classmethod
+    def empty(cls):
+        nothing = np.zeros(0, dtype=np.int64)
+        return cls(nothing.astype(np.uint64), nothing, 0, None, nothing, nothing, nothing)
+
+    def select(self, max_comp, n):
+        """Жадный выбор n лучших непересекающихся зон"""
+        eligible = np.flatnonzero(self.comp_count <= max_comp)
+
+        selected = []
+        covered = np.zeros(self.size, dtype=bool)
+        for i in ranked(self.score, eligible, max(SELECT_CHUNK_MIN, 8 * n)):
+            slot = self.slots[i]
+            if covered[slot]:
+                continue
+            lat, lon = h3int.cell_to_latlng(self.cells[i])
+            selected.append(
+                {
+                    "comp_count": int(self.comp_count[i]),
+                    "center": [float(lat), float(lon)],
+                    "pop_sum": int(self.pop_sum[i]),
+                    "comp_strength": float(self.comp_strength[i]),
+                }
+            )
+            covered[self.disk_of(slot)] = True
+            if len(selected) >= n:
+                break
+
+        return selected
+
+
+def score_zones_numpy(
+    hex_cells, hex_pop, org_cells, org_strength, resolution, k, cache_key=None,
+    org_count=None,
+):
+    """
+    Векторизованная оценка кандидатов по uint64-клеткам. Равные оценки
+    разрешаются по возрастанию id клетки.
+    cache_key (обычно city_id) включает общий для процесса индекс соседства.
+    """
+    cells, pop, strength, count = aggregate_cells(
+        hex_cells, hex_pop, org_cells, org_strength, org_count
+    )
+    if not len(cells):
+        return ScoredZones.empty()
+
+    if cache_key is None:
+        index = NeighborIndex(cells, k)
+    else:
+        index = get_neighbor_index((cache_key, resolution, k), cells, k)
+    slots = index.slots(cells)
+
+    return ScoredZones(
+        cells,
+        slots,
+        len(index.cells),
+        index.disk_of,
+        index.disk_sums(slots, pop),
+        index.disk_sums(slots, strength),
+        index.disk_sums(slots, count),
+    )
+
+
+def pentagon_near(origin, rings):
+    """
+    Есть ли пентагон H3 не дальше rings колец от клетки origin. Проверяется по
+    расстоянию на сфере с двойным запасом: ложное срабатывание лишь
+    переключает оценку на точный движок.
+    """
+    resolution = h3int.get_resolution(origin)
+    limit_m = 2 * (rings + 1) * cell_distance_m(resolution)
+    latlng = h3int.cell_to_latlng(origin)
+    return any(
+        h3.great_circle_distance(latlng, h3int.cell_to_latlng(pentagon), unit="m")
+        <= limit_m
+        for pentagon in h3int.get_pentagons(resolution)
+    )
+
+
+class HexRaster:
+    """
+    Клетки города в локальных IJ-координатах H3, уложенные в 2D-массив.
+    Диск grid_disk(cell, k) в этих координатах - шестиугольник
+    max(|di|, |dj|, |di - dj|) <= k, поэтому сумма по диску - это 2k + 1
+    отрезков строк, каждый берётся из построчных префиксных сумм.
+    """
+
+    def __init__(self, cells, k):
+        origin = cells[0]
+        ij = np.array([h3int.cell_to_local_ij(origin, c) for c in cells], dtype=np.int64)
+        # Рядом с пентагоном cell_to_local_ij работает, но шестиугольник в IJ
+        # уже не совпадает с grid_disk
+        offsets = ij - ij[0]
+        extent = int(np.abs(np.c_[offsets, offsets[:, 0] - offsets[:, 1]]).max())
+        if pentagon_near(origin, extent + k):
+            raise ValueError("Рядом с клетками пентагон H3")
+        self.k = k
+        # Отступ k со всех сторон: окна дисков не выходят за границы массива
+        self.rows = ij[:, 0] - ij[:, 0].min() + k
+        self.cols = ij[:, 1] - ij[:, 1].min() + k
+        self.shape = (int(self.rows.max()) + k + 1, int(self.cols.max()) + k + 1)
+
+        self.slots = np.full(self.shape, -1, dtype=np.int64)
+        self.slots[self.rows, self.cols] = np.arange(len(cells))
+        if np.count_nonzero(self.slots >= 0) != len(cells):
+            raise ValueError("Клетки не укладываются в локальные IJ-координаты")
+
+        di = np.arange(-k, k + 1)[:, None]
+        dj = np.arange(-k, k + 1)[None, :]
+        self.kernel = np.maximum(np.maximum(abs(di), abs(dj)), abs(di - dj)) <= k
+
+    def disk_sums(self, values):
+        raster = np.zeros(self.shape, dtype=values.dtype)
+        raster[self.rows, self.cols] = values
+        prefix = np.zeros((self.shape[0], self.shape[1] + 1), dtype=values.dtype)
+        np.cumsum(raster, axis=1, out=prefix[:, 1:])
+
+        k = self.k
+        result = np.zeros(len(values), dtype=values.dtype)
+        for di in range(-k, k + 1):
+            lo = max(-k, di - k)
+            hi = min(k, di + k)
+            rows = self.rows + di
+            result += prefix[rows, self.cols + hi + 1] - prefix[rows, self.cols + lo]
+        return result
+
+    def disk_of(self, slot):
+        k = self.k
+        row, col = self.rows[slot], self.cols[slot]
+        window = self.slots[row - k : row + k + 1, col - k : col + k + 1]
+        window = window[self.kernel]
+        return window[window >= 0]
+
+
+def score_zones_ij(
+    hex_cells, hex_pop, org_cells, org_strength, resolution, k, cache_key=None,
+    org_count=None,
+):
+    """
+    Оценка кандидатов на растре в локальных IJ-координатах H3:
+    суммы по дискам за O(клеток * k) вместо O(клеток * k^2).
+    Если город не укладывается в одну IJ-систему или рядом с ним (в пределах
+    k колец) пентагон, считает через score_zones_numpy.
+    """
+    cells, pop, strength, count = aggregate_cells(
+        hex_cells, hex_pop, org_cells, org_strength, org_count
+    )
+    if not len(cells):
+        return ScoredZones.empty()
+
+    try:
+        raster = HexRaster(cells, k)
+    except (h3.H3BaseException, ValueError):
+        return score_zones_numpy(
+            hex_cells, hex_pop, org_cells, org_strength, resolution, k,
+            cache_key=cache_key, org_count=org_count,
+        )
+
+    return ScoredZones(
+        cells,
+        np.arange(len(cells)),
+        len(cells),
+        raster.disk_of,
+        raster.disk_sums(pop),
+        raster.disk_sums(strength),
+        raster.disk_sums(count),
+    )
+
+
+def top_zones_numpy(
+    hex_cells, hex_pop, org_cells, org_strength, resolution, radius_m, max_comp, n,
+    cache_key=None,
+):
+    k = grid_k(resolution, radius_m)
+    return score_zones_numpy(
+        hex_cells, hex_pop, org_cells, org_strength, resolution, k, cache_key=cache_key
+    ).select(max_comp, n)
+
+
+def top_zones_ij(
+    hex_cells, hex_pop, org_cells, org_strength, resolution, radius_m, max_comp, n,
+    cache_key=None,
+):
+    k = grid_k(resolution, radius_m)
+    return score_zones_ij(
+        hex_cells, hex_pop, org_cells, org_strength, resolution, k, cache_key=cache_key
+    ).select(max_comp, n)
+
+
+def find_top_zones_numpy(hexs, orgs, resolution, radius_m, max_comp, n, cache_key=None):
+    """top_zones_numpy для входа в формате find_top_zones"""
+    return top_zones_numpy(
+        *hex_arrays(hexs), *org_arrays(orgs, resolution), resolution, radius_m,
+        max_comp, n, cache_key=cache_key,
+    )
+
+
+def find_top_zones_ij(hexs, orgs, resolution, radius_m, max_comp, n, cache_key=None):
+    """top_zones_ij для входа в формате find_top_zones"""
+    return top_zones_ij(
+        *hex_arrays(hexs), *org_arrays(orgs, resolution), resolution, radius_m,
+        max_comp, n, cache_key=cache_key,
+    )
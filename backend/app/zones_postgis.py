@@ -0,0 +1,110 @@
+import h3.api.numpy_int as h3int
+from sqlalchemy import text
+
+from .extensions import db
+from .zones import ALPHA, SELECT_CHUNK_MIN
+
+# Оценка кандидатов целиком в БД (расширение h3-pg): клетки гексагонов и
+# организаций, суммы по h3_grid_disk и оценка как в zones.ScoredZones.
+# Наружу уходят только лучшие :limit кандидатов; равные оценки - по
+# возрастанию id клетки, как у движков numpy и ij.
+SCORE_QUERY = """
+    WITH hexes AS (
+        SELECT h.id::h3index AS cell, COALESCE(h.population, 0)::bigint AS pop
+        FROM city_hexagons h
+        WHERE h.city_id = :city_id
+    ),
+    orgs AS (
+        SELECT
+            h3_lat_lng_to_cell(o.coordinates, :resolution) AS cell,
+            sum(COALESCE(o.strength, 0))::double precision AS strength,
+            count(*)::bigint AS cnt
+        FROM organizations o
+        JOIN organization_categories oc ON oc.organization_id = o.id
+        WHERE o.city_id = :city_id AND oc.category_id = :category_id
+        GROUP BY 1
+    ),
+    cells AS (
+        SELECT
+            COALESCE(h.cell, o.cell) AS cell,
+            COALESCE(h.pop, 0) AS pop,
+            COALESCE(o.strength, 0) AS strength,
+            COALESCE(o.cnt, 0) AS cnt
+        FROM hexes h
+        FULL JOIN orgs o ON o.cell = h.cell
+    ),
+    disks AS (
+        SELECT
+            c.cell,
+            sum(n.pop)::bigint AS pop_sum,
+            sum(n.strength)::double precision AS comp_strength,
+            sum(n.cnt)::bigint AS comp_count
+        FROM cells c
+        CROSS JOIN LATERAL h3_grid_disk(c.cell, :k) AS d(cell)
+        JOIN cells n ON n.cell = d.cell
+        GROUP BY c.cell
+    )
+    SELECT
+        cell::bigint AS cell,
+        pop_sum,
+        comp_strength,
+        comp_count,
+        pop_sum / (1 + :alpha * (comp_strength / GREATEST(comp_count, 1))) AS score
+    FROM disks
+    WHERE comp_count <= :max_comp
+    ORDER BY score DESC, cell::bigint
+    LIMIT :limit
+"""
+
+
+class PostgisZones:
+    """
+    Кандидаты одного (город, категория, k), оцениваемые в PostGIS.
+    Интерфейс как у zones.ScoredZones: select(max_comp, n). Жадный выбор
+    идёт по лучшим кандидатам из БД; если их не хватило, порция растёт в 4 раза.
+    """
+
+    def __init__(self, city_id, category_id, resolution, k):
+        self.city_id = city_id
+        self.category_id = category_id
+        self.resolution = resolution
+        self.k = k
+
+    def candidates(self, max_comp, limit):
+        params = {
+            "city_id": self.city_id,
+            "category_id": self.category_id,
+            "resolution": self.resolution,
+            "k": self.k,
+            "alpha": ALPHA,
+            "max_comp": max_comp,
+            "limit": limit,
+        }
+        return db.session.execute(text(SCORE_QUERY), params).all()
+
+    def select(self, max_comp, n):
+        """Жадный выбор n лучших непересекающихся зон"""
+        limit = max(SELECT_CHUNK_MIN, 8 * n)
+        while True:
+            rows = self.candidates(max_comp, limit)
+            selected = []
+            covered = set()
+            for row in rows:
+                cell = int(row.cell)
+                if cell in covered:
+                    continue
+                lat, lon = h3int.cell_to_latlng(cell)
+                selected.append(
+                    {
+                        "comp_count": int(row.comp_count),
+                        "center": [float(lat), float(lon)],
+                        "pop_sum": int(row.pop_sum),
+                        "comp_strength": float(row.comp_strength),
+                    }
+                )
+                covered.update(int(c) for c in h3int.grid_disk(cell, self.k))
+                if len(selected) >= n:
+                    return selected
+            if len(rows) < limit:
+                return selected
+            limit *= 4
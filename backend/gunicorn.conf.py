@@ -0,0 +1,36 @@
+import multiprocessing
+import os
+
+# Боевой запуск: cd backend && gunicorn wsgi:app
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+# Перезапуск воркера после max_requests запросов (со случайным разбросом,
+# чтобы воркеры не перезапускались одновременно) - защита от роста памяти
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+# Приложение и прогретые кэши создаются в мастере до форка
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    """
+    Соединения с БД и пулы, созданные в мастере, воркеру не годятся:
+    сбрасываем их, прогретые кэши остаются общими
+    """
+    if not preload_app:
+        return
+    from wsgi import app
+    from app import concurrency, scoring_pool
+    from app.extensions import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+    concurrency.after_fork(app)
+    scoring_pool.after_fork(app)
@@ -1,4 +1,5 @@
 from app import create_app
+from app.routes import warm_caches
 from app.extensions import db
 from sqlalchemy import text
 
@@ -17,4 +18,5 @@ def check_db_connection():
 
 if __name__ == "__main__":
     check_db_connection()
+    warm_caches(app)
     app.run(debug=True)
@@ -0,0 +1,8 @@
+from app import create_app
+from app.routes import warm_caches
+
+# Точка входа для боевого сервера: gunicorn wsgi:app (настройки в gunicorn.conf.py).
+# При preload_app модуль импортируется в мастере до форка, поэтому прогретые
+# кэши городов и категорий достаются воркерам copy-on-write.
+app = create_app()
+warm_caches(app)
@@ -8,10 +8,11 @@ from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from config import db_params
+from data_version import bump_data_version
 import time
 
 
-def save_to_db(data):
+def save_to_db(data, city_id):
     conn = psycopg2.connect(**db_params)
     cursor = conn.cursor()
     query = """
@@ -22,6 +23,7 @@ def save_to_db(data):
     """
 
     execute_values(cursor, query, data)
+    bump_data_version(cursor, city_id, "cian_listings")
     print('вставлено!')
 
     conn.commit()
@@ -118,7 +120,7 @@ for ci in city:
                 print("Следующего элемента нет (это последняя страница)")
                 break
 
-        save_to_db(data)
+        save_to_db(data, ci["id"])
 
     except NoSuchElementException:
         print("Не удалось найти элементы на странице")
@@ -0,0 +1,54 @@
+from collections import defaultdict
+
+import h3
+from psycopg2.extras import execute_values
+
+from data_version import bump_data_version
+
+# Разрешение клеток, как ZONES_RESOLUTION в backend/app/routes.py
+RESOLUTION = 10
+
+SELECT_ORGANIZATIONS_SQL = """
+    SELECT o.city_id, oc.category_id, ST_Y(o.coordinates), ST_X(o.coordinates), o.strength
+    FROM organizations o
+    JOIN organization_categories oc ON oc.organization_id = o.id
+    WHERE o.coordinates IS NOT NULL
+"""
+
+INSERT_CELLS_SQL = """
+    INSERT INTO competitor_cells
+        (city_id, category_id, resolution, h3_cell, strength_sum, org_count)
+    VALUES %s
+"""
+
+
+def refresh_competitor_cells(cursor, resolution=RESOLUTION):
+    """
+    Пересчитывает competitor_cells: сила и число организаций каждой категории
+    по клеткам H3. Версии данных городов увеличиваются в той же транзакции,
+    чтобы бэкенд не держал в кэше старые агрегаты.
+    """
+    cursor.execute(SELECT_ORGANIZATIONS_SQL)
+    cells = defaultdict(lambda: [0.0, 0])
+    for city_id, category_id, lat, lon, strength in cursor.fetchall():
+        cell = h3.str_to_int(h3.latlng_to_cell(lat, lon, resolution))
+        aggregate = cells[(city_id, category_id, cell)]
+        aggregate[0] += strength or 0
+        aggregate[1] += 1
+
+    cursor.execute(
+        "DELETE FROM competitor_cells WHERE resolution = %s RETURNING city_id",
+        (resolution,),
+    )
+    changed = {city_id for city_id, in cursor.fetchall()}
+    execute_values(
+        cursor,
+        INSERT_CELLS_SQL,
+        [
+            (city_id, category_id, resolution, cell, strength, count)
+            for (city_id, category_id, cell), (strength, count) in cells.items()
+        ],
+    )
+    changed |= {city_id for city_id, _, _ in cells}
+    for city_id in changed:
+        bump_data_version(cursor, city_id, "competitor_cells")
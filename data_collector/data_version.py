@@ -0,0 +1,13 @@
+BUMP_DATA_VERSION_SQL = """
+    INSERT INTO data_versions (city_id, version, source)
+    VALUES (%s, 1, %s)
+    ON CONFLICT (city_id) DO UPDATE
+        SET version = data_versions.version + 1,
+            source = EXCLUDED.source,
+            updated_at = now();
+"""
+
+
+def bump_data_version(cursor, city_id, source):
+    """Отмечает, что данные города обновились (в той же транзакции, что и запись)"""
+    cursor.execute(BUMP_DATA_VERSION_SQL, (city_id, source))
@@ -17,6 +17,8 @@ from psycopg2.extras import execute_values
 from selenium.webdriver.support import expected_conditions as EC
 from concurrent.futures import ThreadPoolExecutor
 from config import db_params
+from data_version import bump_data_version
+from competitor_cells import refresh_competitor_cells
 import geopandas as gpd
 from functools import partial
 from shapely import wkt
@@ -256,6 +258,7 @@ for selectedCity in city:
                     execute_values(cursor, org_cat_query, org_cat_pairs)
                 else:
                     print("No category pairs to insert.")
+                bump_data_version(cursor, selectedCity["id"], "organizations")
                 conn.commit()
                 cursor.close()
                 conn.close()
@@ -265,3 +268,12 @@ for selectedCity in city:
             print("no snippets")
 
 driver.quit()
+
+# Агрегаты конкурентов по клеткам H3 для оценки зон в бэкенде
+conn = psycopg2.connect(**db_params)
+cursor = conn.cursor()
+refresh_competitor_cells(cursor)
+conn.commit()
+cursor.close()
+conn.close()
+print("Агрегаты конкурентов по клеткам обновлены")
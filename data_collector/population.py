@@ -4,6 +4,7 @@ import numpy as np
 import pandas as pd
 import psycopg2
 from config import db_params, sqlalchemy_url
+from data_version import BUMP_DATA_VERSION_SQL
 import h3
 from shapely.geometry import Polygon
 import json
@@ -178,6 +179,8 @@ def create_hexagons(geoJson, residential_buildings_gdf, cityid, resolution=10):
         if_exists="append",
         index=False,
     )
+    with engine.begin() as conn:
+        conn.exec_driver_sql(BUMP_DATA_VERSION_SQL, (cityid, "population"))
 
     # plot_hexagons_population(filtered_hex_gdf)
 
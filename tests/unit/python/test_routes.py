@@ -206,3 +206,35 @@ def test_get_analysis_success(
     assert history_entry is not None
     assert history_entry.city_id == sample_city.id
     assert history_entry.radius == 1.0
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/tiles/competitors/10/0/0.mvt?city_id=1&category_id=1",
+        "/tiles/rentals/10/0/0.mvt?city_id=1",
+        "/api/competitors?city_id=1&category_id=1",
+        "/api/rentals?city_id=1",
+    ],
+)
+def test_data_endpoints_require_login(client, path):
+    response = client.get(path)
+    assert response.status_code in (302, 401)
+
+
+def test_city_bounds_rejects_unknown_detail(client):
+    response = client.get("/api/cities/1/bounds?detail=ultra")
+    assert response.status_code == 400
+
+
+def test_readiness_follows_warm_flag(app, client):
+    from app.routes import get_categories_cached, get_cities_cached
+
+    app.extensions.pop("caches_warm", None)
+    assert client.get("/api/health/ready").status_code == 503
+
+    app.extensions["caches_warm"] = True
+    get_cities_cached.cache_clear()
+    assert client.get("/api/health/ready").get_json() == {"status": "ready"}
+    assert get_cities_cached.cache.stats()["ttl"] == 0
+    assert get_categories_cached.cache.stats()["ttl"] == 0
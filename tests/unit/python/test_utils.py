@@ -1,3 +1,4 @@
+import pytest
 from app.routes import (
     validate_analysis_params,
     calculate_avg_rent,
@@ -109,3 +110,618 @@ def test_calculate_avg_cost_for_square_with_zero_area():
         {"price": 1500, "total_area": 15},
     ]
     assert calculate_avg_cost_for_square(places) == int((1000 / 10 + 1500 / 15) / 2)
+
+
+def _sample_zone_inputs():
+    import h3
+
+    center = h3.latlng_to_cell(55.75, 37.62, 10)
+    hexs = [
+        {"hex_id": cell, "pop": (i * 2654435761) % 1000003}
+        for i, cell in enumerate(sorted(h3.grid_disk(center, 20)))
+    ]
+    orgs = []
+    for i, cell in enumerate(sorted(h3.grid_disk(center, 22))[::53]):
+        lat, lon = h3.cell_to_latlng(cell)
+        orgs.append({"coordinates": [lat, lon], "strength": float(i % 5)})
+    return hexs, orgs
+
+
+def test_find_top_zones_numpy_matches_python():
+    from app.zones import find_top_zones_numpy
+
+    hexs, orgs = _sample_zone_inputs()
+    for radius_m in (500, 1000, 2000):
+        for max_comp in (1, 5, 20):
+            expected = find_top_zones(hexs, orgs, 10, radius_m, max_comp, 10)
+            assert find_top_zones_numpy(hexs, orgs, 10, radius_m, max_comp, 10) == expected
+
+
+def test_find_top_zones_numpy_empty():
+    from app.zones import find_top_zones_numpy
+
+    assert find_top_zones_numpy([], [], 10, 1000, 5, 3) == []
+
+
+def test_find_top_zones_numpy_shared_index_grows_with_new_cells():
+    from app.zones import find_top_zones_numpy, clear_neighbor_indexes
+
+    clear_neighbor_indexes()
+    hexs, orgs = _sample_zone_inputs()
+    expected_no_orgs = find_top_zones(hexs, [], 10, 1000, 5, 10)
+    expected = find_top_zones(hexs, orgs, 10, 1000, 5, 10)
+
+    assert find_top_zones_numpy(hexs, [], 10, 1000, 5, 10, cache_key=1) == expected_no_orgs
+    assert find_top_zones_numpy(hexs, orgs, 10, 1000, 5, 10, cache_key=1) == expected
+    assert find_top_zones_numpy(hexs, [], 10, 1000, 5, 10, cache_key=1) == expected_no_orgs
+
+
+def test_neighbor_indexes_are_bounded_by_bytes():
+    from app import cache, zones
+
+    zones.clear_neighbor_indexes()
+    hexs, orgs = _sample_zone_inputs()
+    zones.find_top_zones_numpy(hexs, orgs, 10, 1000, 5, 10, cache_key=1)
+    stats = cache.stats()["neighbor_index"]
+    assert stats["entries"] == 1
+    assert 0 < stats["bytes"] <= zones.NEIGHBOR_INDEX_MAX_BYTES
+    assert cache.invalidate(city_id=1)["neighbor_index"] == 1
+
+
+def test_find_top_zones_ij_matches_python():
+    from app.zones import find_top_zones_ij
+
+    hexs, orgs = _sample_zone_inputs()
+    for radius_m in (500, 1000, 2000):
+        for max_comp in (1, 5, 20):
+            expected = find_top_zones(hexs, orgs, 10, radius_m, max_comp, 10)
+            assert find_top_zones_ij(hexs, orgs, 10, radius_m, max_comp, 10) == expected
+
+
+@pytest.mark.parametrize("distance", [3, 10])
+def test_find_top_zones_ij_matches_python_near_pentagon(distance):
+    import h3
+    from app.zones import find_top_zones_ij
+
+    pentagon = sorted(h3.get_pentagons(10))[0]
+    center = sorted(h3.grid_ring(pentagon, distance))[0]
+    hexs = [
+        {"hex_id": cell, "pop": (i * 2654435761) % 1000003}
+        for i, cell in enumerate(sorted(h3.grid_disk(center, 12)))
+    ]
+    for radius_m in (500, 1500):
+        expected = find_top_zones(hexs, [], 10, radius_m, 5, 10)
+        assert find_top_zones_ij(hexs, [], 10, radius_m, 5, 10) == expected
+
+
+def test_ranked_matches_stable_sort_across_chunks():
+    import numpy as np
+    from app.zones import ranked
+
+    score = np.array([3.0, 1.0, 3.0, 2.0, 5.0, 2.0, 2.0, 0.5, 3.0, 4.0])
+    candidates = np.flatnonzero(score != 0.5)
+    expected = sorted(candidates, key=lambda i: score[i], reverse=True)
+    assert list(ranked(score, candidates, 2)) == expected
+
+
+def test_scored_zones_select_is_prefix_for_smaller_n():
+    from app.zones import hex_arrays, org_arrays, grid_k, score_zones_numpy
+
+    hexs, orgs = _sample_zone_inputs()
+    scored = score_zones_numpy(
+        *hex_arrays(hexs), *org_arrays(orgs, 10), 10, grid_k(10, 1000)
+    )
+    full = scored.select(5, 100)
+    assert scored.select(5, 3) == full[:3]
+    assert scored.select(5, 10) == find_top_zones(hexs, orgs, 10, 1000, 5, 10)
+
+
+def test_grid_radius_m_round_trips_k():
+    from app.zones import grid_k, grid_radius_m
+
+    for k in range(1, 20):
+        assert grid_k(10, grid_radius_m(10, k)) == k
+
+
+def test_rental_index_matches_list_helpers():
+    from app.rentals import RentalIndex
+
+    places = [
+        {"price": 3000, "total_area": 30},
+        {"price": 1000, "total_area": 10},
+        {"price": 2000, "total_area": None},
+        {"price": 2500, "total_area": 0},
+        {"price": 1500, "total_area": 15},
+    ]
+    index = RentalIndex(places)
+    for limit in (0, 999, 1000, 1500, 2000, 2500, 10000):
+        subset = [p for p in places if p["price"] <= limit]
+        assert sorted(p["price"] for p in index.places_up_to(limit)) == sorted(
+            p["price"] for p in subset
+        )
+        if subset:
+            assert index.avg_rent(limit) == calculate_avg_rent(subset)
+            assert index.avg_cost_for_square(limit) == calculate_avg_cost_for_square(subset)
+        else:
+            assert index.avg_rent(limit) is None
+            assert index.avg_cost_for_square(limit) is None
+
+
+def test_sized_cache_evicts_by_bytes_and_expires():
+    from app.cache import SizedCache
+
+    cache = SizedCache("test", max_bytes=3000, ttl=60)
+    for i in range(10):
+        cache.set(i, "x" * 1000)
+    stats = cache.stats()
+    assert stats["bytes"] <= 3000
+    assert stats["evictions"] > 0
+    assert cache.get(9) == (True, "x" * 1000)
+    assert cache.get(0) == (False, None)
+
+    cache.ttl = -1
+    cache.set("old", 1)
+    assert cache.get("old") == (False, None)
+    assert cache.stats()["expirations"] == 1
+
+
+def test_estimate_size_counts_objects_behind_bound_methods():
+    import numpy as np
+    from app.cache import estimate_size
+
+    class Index:
+        def __init__(self):
+            self.matrix = np.zeros(100_000, dtype=np.int64)
+
+        def disk_of(self, slot):
+            return slot
+
+    assert estimate_size({"disk_of": Index().disk_of}) > 800_000
+
+
+def test_cached_invalidates_by_city_and_category():
+    from app.cache import cached, invalidate
+
+    calls = []
+
+    @cached("test_invalidate", max_bytes=1024 * 1024, tags=("city_id", "category_id"))
+    def load(city_id, category_id):
+        calls.append((city_id, category_id))
+        return [city_id, category_id]
+
+    load(1, 1), load(1, 2), load(2, 1)
+    load(1, 1)
+    assert len(calls) == 3
+
+    assert invalidate(category_id=2)["test_invalidate"] == 1
+    assert invalidate(city_id=1)["test_invalidate"] == 1
+    load(1, 1), load(2, 1)
+    assert calls[3:] == [(1, 1)]
+    assert load.cache.stats()["hits"] == 2
+
+
+def test_data_versions_are_part_of_cache_keys():
+    from app.cache import cached, data_versions
+
+    versions = {1: 1}
+    calls = []
+
+    @cached("test_versions", max_bytes=1024 * 1024, tags=("city_id",))
+    def load(city_id):
+        calls.append(city_id)
+        return city_id
+
+    old_loader, old_interval = data_versions.loader, data_versions.interval
+    data_versions.loader, data_versions.interval = lambda: dict(versions), 0
+    try:
+        load(1), load(1)
+        assert calls == [1]
+        versions[1] = 2
+        load(1)
+        assert calls == [1, 1]
+    finally:
+        data_versions.loader, data_versions.interval = old_loader, old_interval
+        data_versions.versions = {}
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    import threading
+    import time
+    from app.cache import SingleFlight
+
+    flight = SingleFlight(timeout=5)
+    calls = []
+    results = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return 42
+
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do("key", slow)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == [42] * 8
+    assert flight.coalesced == 7
+
+
+def test_encoded_body_picks_encoding_from_accept_header():
+    import gzip
+    from werkzeug.http import parse_accept_header
+    from app.responses import EncodedBody
+
+    body = EncodedBody.from_text('{"a": 1}', encodings=("gzip",))
+    encoding, data = body.choose(parse_accept_header("gzip, deflate"))
+    assert encoding == "gzip"
+    assert gzip.decompress(data) == b'{"a": 1}'
+    assert body.choose(parse_accept_header("identity")) == (None, b'{"a": 1}')
+
+
+def test_encoded_body_from_json_matches_jsonify():
+    from flask import Flask, jsonify
+    from app.responses import EncodedBody
+
+    payload = {"zones": [{"hex_id": "8a", "score": 1.5}], "name": "Город"}
+    app = Flask(__name__)
+    with app.app_context():
+        assert EncodedBody.from_json(payload, ()).raw == jsonify(payload).get_data()
+
+
+def test_encoded_body_etag_not_modified():
+    from flask import Flask
+    from app.responses import EncodedBody
+
+    body = EncodedBody.from_text('{"a": 1}', encodings=("gzip",))
+    app = Flask(__name__)
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = body.response(etag="hexes-1-v3", cache_control="public")
+        assert response.status_code == 200
+        assert response.headers["ETag"] == '"hexes-1-v3-gzip"'
+        assert response.headers["Cache-Control"] == "public"
+
+    headers = {"Accept-Encoding": "gzip", "If-None-Match": '"hexes-1-v3-gzip"'}
+    with app.test_request_context(headers=headers):
+        response = body.response(etag="hexes-1-v3")
+        assert response.status_code == 304
+        assert response.get_data() == b""
+
+
+def test_hex_geometry_matches_cell_boundary():
+    import h3
+    from app.routes import hex_geometry
+
+    cell = h3.latlng_to_cell(45.03, 38.97, 10)
+    ring = hex_geometry(cell)["coordinates"][0]
+    assert ring[0] == ring[-1]
+    assert [(lat, lng) for lng, lat in ring[:-1]] == list(h3.cell_to_boundary(cell))
+
+
+def test_valid_tile_bounds():
+    from app.tiles import valid_tile
+
+    assert valid_tile(0, 0, 0)
+    assert valid_tile(10, 1023, 0)
+    assert not valid_tile(10, 1024, 0)
+    assert not valid_tile(1, 0, -1)
+    assert not valid_tile(23, 0, 0)
+
+
+def test_point_clusters_prefix_matches_brute_force():
+    import h3
+    from app.clusters import PointClusters, cluster_resolution
+
+    points = [
+        {"coordinates": [55.75 + i * 0.003, 37.62 - i * 0.002], "price": 1000 + i}
+        for i in range(40)
+    ]
+    clusters = PointClusters.from_points(points, "price", 8)
+    for m in (0, 1, 17, 40):
+        groups = {}
+        for point in points[:m]:
+            cell = h3.latlng_to_cell(*point["coordinates"], 8)
+            groups.setdefault(cell, []).append(point["price"])
+        result = clusters.rental_clusters(m)
+        assert sorted((c["count"], c["avg_price"]) for c in result) == sorted(
+            (len(prices), int(sum(prices) / len(prices))) for prices in groups.values()
+        )
+
+    assert cluster_resolution(0) == 6
+    assert cluster_resolution(22) is None
+
+
+def test_parse_bbox():
+    import pytest
+    from app.points import MAX_LATITUDE, parse_bbox
+
+    assert parse_bbox("37.5,55.7,37.7,55.8") == (37.5, 55.7, 37.7, 55.8)
+    assert parse_bbox("-180,-90,180,90") == (-180, -MAX_LATITUDE, 180, MAX_LATITUDE)
+    for value in (
+        "37.5,55.7,37.7", "37.7,55.7,37.5,55.8", "a,b,c,d", "0,-91,1,0", "0,86,1,89",
+    ):
+        with pytest.raises(ValueError):
+            parse_bbox(value)
+
+
+def test_cached_prime_and_contains():
+    from app.cache import cached
+
+    calls = []
+
+    @cached("test_prime", max_bytes=1024 * 1024, tags=("city_id",))
+    def load(city_id):
+        calls.append(city_id)
+        return city_id
+
+    assert not load.contains(1)
+    load.prime("primed", 1)
+    assert load.contains(1)
+    assert load(1) == "primed"
+    assert calls == []
+
+
+def test_build_bounds_levels():
+    import json
+    from app.routes import BOUND_DETAILS, build_bounds
+
+    assert build_bounds(1, None) is None
+    assert build_bounds(1, (None,) * len(BOUND_DETAILS)) is None
+
+    polygon = {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}
+    bounds = build_bounds(7, [json.dumps(polygon)] * len(BOUND_DETAILS))
+    assert list(bounds) == list(BOUND_DETAILS)
+    for detail, feature in bounds.items():
+        assert feature["type"] == "Feature"
+        assert feature["geometry"] == polygon
+        assert feature["properties"] == {"city_id": 7, "detail": detail}
+
+
+def test_parse_analysis_options_defaults():
+    from app.routes import DEFAULT_ANALYSIS_BOUND_DETAIL, parse_analysis_options
+
+    options, message = parse_analysis_options({})
+    assert message is None
+    assert options[1:] == (DEFAULT_ANALYSIS_BOUND_DETAIL, None)
+    assert parse_analysis_options({"include_hexes": "0"})[0][0] is None
+
+
+@pytest.mark.parametrize(
+    "args",
+    [{"hex_format": "svg"}, {"detail": "ultra"}, {"cluster": "x"}, {"cluster": "99"}],
+)
+def test_parse_analysis_options_rejects(args):
+    from app.routes import parse_analysis_options
+
+    options, message = parse_analysis_options(args)
+    assert options is None and message
+
+
+def test_run_concurrently_overlaps_fetches():
+    import time
+    from flask import Flask, current_app
+    from app import concurrency
+
+    app = Flask(__name__)
+    app.config["FETCH_WORKERS"] = 4
+    concurrency.init_app(app)
+
+    def fetch(value):
+        time.sleep(0.2)
+        return value, current_app.name
+
+    tasks = {name: (fetch, (name,)) for name in ("a", "b", "c")}
+    with app.app_context():
+        start = time.perf_counter()
+        results = concurrency.run_concurrently(tasks)
+    assert time.perf_counter() - start < 0.5
+    assert results == {name: (name, app.name) for name in tasks}
+
+
+def test_postgis_zones_select_matches_python_on_ranked_rows():
+    from types import SimpleNamespace
+    import numpy as np
+    from app.zones import hex_arrays, org_arrays, grid_k, score_zones_numpy
+    from app.zones_postgis import PostgisZones
+
+    hexs, orgs = _sample_zone_inputs()
+    k = grid_k(10, 1000)
+    scored = score_zones_numpy(*hex_arrays(hexs), *org_arrays(orgs, 10), 10, k)
+
+    class RankedRows(PostgisZones):
+        # Строки в том виде и порядке, в каком их отдаёт SCORE_QUERY
+        def candidates(self, max_comp, limit):
+            order = np.lexsort((scored.cells, -scored.score))
+            rows = [
+                SimpleNamespace(
+                    cell=int(scored.cells[i]),
+                    pop_sum=scored.pop_sum[i],
+                    comp_strength=scored.comp_strength[i],
+                    comp_count=scored.comp_count[i],
+                )
+                for i in order
+                if scored.comp_count[i] <= max_comp
+            ]
+            return rows[:limit]
+
+    zones = RankedRows(1, 1, 10, k)
+    for max_comp in (1, 5, 20):
+        assert zones.select(max_comp, 10) == find_top_zones(hexs, orgs, 10, 1000, max_comp, 10)
+
+
+def test_prebinned_competitor_cells_match_rows():
+    from collections import defaultdict
+    from app.zones import (
+        hex_arrays,
+        org_arrays,
+        grid_k,
+        score_zones_numpy,
+        competitor_cell_arrays,
+    )
+
+    hexs, orgs = _sample_zone_inputs()
+    orgs = orgs + orgs[:5]  # несколько организаций в одной клетке
+    binned = defaultdict(lambda: [0.0, 0])
+    for cell, strength in zip(*org_arrays(orgs, 10)):
+        binned[int(cell)][0] += strength
+        binned[int(cell)][1] += 1
+    cells, strength, count = competitor_cell_arrays(
+        [(cell, s, n) for cell, (s, n) in binned.items()]
+    )
+
+    k = grid_k(10, 1000)
+    scored = score_zones_numpy(*hex_arrays(hexs), cells, strength, 10, k, org_count=count)
+    assert scored.select(5, 10) == find_top_zones(hexs, orgs, 10, 1000, 5, 10)
+
+
+def test_with_coordinates_decodes_wkb_in_bulk():
+    import shapely
+    from app.geometry import with_coordinates
+
+    rows = [
+        (memoryview(shapely.to_wkb(shapely.Point(37.62, 55.75))), 1, "a"),
+        (shapely.to_wkb(shapely.Point(38.97, 45.03)), 2, "b"),
+    ]
+    assert with_coordinates(rows) == [(55.75, 37.62, 1, "a"), (45.03, 38.97, 2, "b")]
+    assert with_coordinates([]) == []
+
+
+def test_wsgi_environ_from_asgi_scope():
+    from werkzeug.wrappers import Request
+    from app.asgi import wsgi_environ
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/api/analysis",
+        "query_string": b"city_id=1&category_id=2",
+        "headers": [
+            (b"cookie", b"_cookie_name=abc"),
+            (b"cookie", b"other=1"),
+            (b"accept-encoding", b"gzip"),
+            (b"content-type", b"application/json"),
+        ],
+        "server": ("localhost", 5000),
+        "client": ("127.0.0.1", 12345),
+    }
+    request = Request(wsgi_environ(scope, b"{}"))
+    assert request.path == "/api/analysis"
+    assert request.args["category_id"] == "2"
+    assert request.cookies["_cookie_name"] == "abc"
+    assert request.cookies["other"] == "1"
+    assert request.accept_encodings["gzip"]
+    assert request.content_type == "application/json"
+    assert request.get_data() == b"{}"
+
+
+def test_analysis_plan_skips_requests_without_session(monkeypatch):
+    from types import SimpleNamespace
+    from flask import Flask
+    from app import routes
+    from app.asgi import AsgiApp, wsgi_environ
+
+    def fail(*args):
+        raise AssertionError("без сессии входные данные не проверяются")
+
+    monkeypatch.setattr(routes, "missing_analysis_inputs", fail)
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/api/analysis",
+        "query_string": b"city_id=1&category_id=2&radius=1&rent=1000&competitors=5&area_count=5",
+        "headers": [],
+    }
+    app = Flask(__name__)
+    app.secret_key = "test"
+    plan = AsgiApp.analysis_plan(SimpleNamespace(flask_app=app), wsgi_environ(scope, b""))
+    assert plan is None
+
+
+def test_scoring_pool_matches_in_process_selection():
+    from types import SimpleNamespace
+    from app import scoring_pool
+    from app.zones import hex_arrays, org_arrays, grid_k
+
+    hexs, orgs = _sample_zone_inputs()
+    k = grid_k(10, 1000)
+    config = {"SCORING_PROCESSES": 1, "SCORING_QUEUE": 2, "SCORING_TIMEOUT": 60}
+    scoring_pool.init_app(SimpleNamespace(config=config))
+    try:
+        result = scoring_pool.top_zones(
+            (1, 1, k, 0),
+            hex_arrays(hexs),
+            (*org_arrays(orgs, 10), None),
+            "numpy",
+            10,
+            k,
+            5,
+            10,
+        )
+    finally:
+        scoring_pool.shutdown()
+    assert result == find_top_zones(hexs, orgs, 10, 1000, 5, 10)
+
+
+def test_shared_arrays_keep_pinned_sets_until_released():
+    import numpy as np
+    from multiprocessing import shared_memory
+    from app.scoring_pool import SharedArrays
+
+    shared = SharedArrays(max_entries=1)
+    try:
+        (name, _, _), = shared.acquire("a", [np.arange(3)])
+        shared.acquire("b", [np.arange(3)])
+        shared_memory.SharedMemory(name=name).close()  # "a" ещё закреплён
+
+        shared.release("a")
+        assert list(shared.entries) == ["b"]
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+    finally:
+        shared.clear()
+
+
+def test_scoring_pool_restarts_after_worker_death():
+    import os
+    import signal
+    from types import SimpleNamespace
+    from app import scoring_pool
+    from app.zones import hex_arrays, org_arrays, grid_k
+
+    hexs, orgs = _sample_zone_inputs()
+    k = grid_k(10, 1000)
+    args = (hex_arrays(hexs), (*org_arrays(orgs, 10), None), "numpy", 10, k, 5, 10)
+    config = {"SCORING_PROCESSES": 1, "SCORING_QUEUE": 2, "SCORING_TIMEOUT": 60}
+    scoring_pool.init_app(SimpleNamespace(config=config))
+    try:
+        scoring_pool.top_zones((1, 1, k, 0), *args)
+        broken = scoring_pool.executor
+        for pid in list(broken._processes):
+            os.kill(pid, signal.SIGKILL)
+        with pytest.raises(scoring_pool.BrokenProcessPool):
+            scoring_pool.top_zones((1, 1, k, 1), *args)
+        assert scoring_pool.executor is not broken
+        result = scoring_pool.top_zones((1, 1, k, 2), *args)
+    finally:
+        scoring_pool.shutdown()
+    assert result == find_top_zones(hexs, orgs, 10, 1000, 5, 10)
+
+
+def test_concurrency_after_fork_replaces_pool_without_stopping_parent():
+    from flask import Flask
+    from app import concurrency
+
+    app = Flask(__name__)
+    app.config["FETCH_WORKERS"] = 2
+    concurrency.init_app(app)
+    parent = concurrency.executor
+
+    concurrency.after_fork(app)
+    assert concurrency.executor is not parent
+    assert parent.submit(lambda: 1).result() == 1
+    parent.shutdown()